@@ -7,12 +7,11 @@ import statistics
 import re
 from collections import defaultdict
 
-MODES = {
-    'brili': r'\bbrili\b',
-    'brilirs': r'\bbrilirs\b',
-    'brilift-jit': r'\bbrilift -j',
-    'brilift-aot': r'^\./[^/]+ '
-}
+# The modes are named the same way in `brench-history`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'brench'))
+from brench import BENCH_JSON_RUNS as MODES
+
 BASELINE = 'brili'
 
 
@@ -8,42 +8,310 @@ import re
 import csv
 import sys
 import os
+import asyncio
+import collections
+import contextlib
+import contextvars
 from concurrent import futures
 import glob
+import hashlib
+import importlib
+import io
+import json
+import math
+import multiprocessing
+import shlex
+import shutil
+import resource
+import signal
+import sqlite3
+import statistics
+import tempfile
+import time
+import traceback
 
 __version__ = '1.0.0'
 
 ARGS_RE = r'ARGS: (.*)'
 
 
-def run_pipe(cmds, input, timeout):
+# Characters that need a shell to interpret them. Commands without these
+# are split into words and executed directly.
+SHELL_CHARS = set('|&;<>()$`*?[]{}~!#')
+
+
+def command_argv(cmd):
+    """Split a command into an argument list for direct execution, or
+    return None if it uses shell features (and so needs `/bin/sh`).
+    """
+    if SHELL_CHARS & set(cmd):
+        return None
+    try:
+        argv = shlex.split(cmd)
+    except ValueError:
+        return None
+    if not argv or '=' in argv[0]:  # Environment variable assignment.
+        return None
+    return argv
+
+
+# The CPU that the current job is pinned to, if any.
+PINNED_CPU = contextvars.ContextVar('PINNED_CPU', default=None)
+
+
+def kill_group(proc):
+    """Kill a process along with everything in its process group.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def memory_limiter(mib):
+    """Get a function that caps the memory of the current process at the
+    given number of MiB, to run in a child before it executes a command.
+
+    This limits the data segment rather than the address space, because
+    some runtimes (such as Deno, which runs `brili`) reserve large
+    amounts of address space that they never use.
+    """
+    limit = mib << 20
+
+    def limiter():
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    return limiter
+
+
+def parse_cpu_list(text):
+    """Parse a Linux CPU list, like `0-3,8`, into a set of CPU numbers.
+    """
+    cpus = set()
+    for part in text.strip().split(','):
+        if part:
+            first, _, last = part.partition('-')
+            cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def pinnable_cpus(idle_siblings=False):
+    """List the CPUs that Brench can pin jobs to: all the CPUs it is
+    allowed to run on. With `idle_siblings`, leave out all but one
+    hyperthread of each physical core, so jobs don't share a core.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    if not idle_siblings:
+        return cpus
+    chosen = []
+    taken = set()
+    for cpu in cpus:
+        if cpu in taken:
+            continue
+        path = '/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list'
+        try:
+            with open(path.format(cpu)) as f:
+                taken |= parse_cpu_list(f.read())
+        except OSError:
+            pass
+        chosen.append(cpu)
+    return chosen
+
+
+def child_setup(max_memory=None, cpu=None):
+    """Get a function to run in a child process before it executes a
+    command, which caps its memory at `max_memory` MiB and pins it to
+    `cpu`, or None if there is nothing to do.
+    """
+    if max_memory is None and cpu is None:
+        return None
+    limiter = memory_limiter(max_memory) if max_memory else None
+
+    def setup():
+        if limiter:
+            limiter()
+        if cpu is not None:
+            os.sched_setaffinity(0, {cpu})
+    return setup
+
+
+def reap(pid):
+    """Wait for a process to exit. Return its exit status, resource
+    usage, and the time it was reaped.
+    """
+    _, status, ru = os.wait4(pid, 0)
+    return status, ru, time.perf_counter()
+
+
+# Children waiting on SIGCHLD, when pidfds aren't available: pid -> future.
+SIGCHLD_WAITERS = {}
+
+
+def on_sigchld():
+    """Reap any of the waiting children that have exited."""
+    for pid, fut in list(SIGCHLD_WAITERS.items()):
+        done, status, ru = os.wait4(pid, os.WNOHANG)
+        if done:
+            del SIGCHLD_WAITERS[pid]
+            if not fut.done():
+                fut.set_result((status, ru, time.perf_counter()))
+
+
+async def wait_child(pid):
+    """Wait for a child process to exit without blocking, and return the
+    same things as `reap`.
+
+    Use a pidfd that becomes readable when the child exits if the
+    platform has them, or else a SIGCHLD handler that polls with
+    `WNOHANG`. Only if neither works (e.g., outside the main thread on
+    macOS) is the child reaped in a thread.
+    """
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is not None:
+        def ready():
+            loop.remove_reader(fd)
+            if not fut.done():
+                fut.set_result(reap(pid))
+        loop.add_reader(fd, ready)
+        try:
+            return await fut
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+
+    try:
+        loop.add_signal_handler(signal.SIGCHLD, on_sigchld)
+    except (NotImplementedError, RuntimeError, ValueError):
+        return await loop.run_in_executor(None, reap, pid)
+    SIGCHLD_WAITERS[pid] = fut
+    on_sigchld()  # It may have exited before the handler was installed.
+    try:
+        return await fut
+    finally:
+        SIGCHLD_WAITERS.pop(pid, None)
+
+
+def stage_usage(ru, start, end, cpu=None):
+    """Summarize a finished stage's resource usage: its start and exit
+    times, user and system CPU time in seconds, peak resident set size in
+    KiB, and the CPU it was pinned to (or None).
+    """
+    maxrss = ru.ru_maxrss
+    if sys.platform == 'darwin':  # Reported in bytes, not KiB.
+        maxrss //= 1024
+    return {
+        'start': start,
+        'end': end,
+        'user': ru.ru_utime,
+        'sys': ru.ru_stime,
+        'maxrss': maxrss,
+        'cpu': cpu,
+    }
+
+
+async def run_pipe(cmds, input, timeout, max_memory=None):
     """Execute a pipeline of shell commands.
 
     Send the given input (text) string into the first command, then pipe
     the output of each command into the next command in the sequence.
-    Collect and return the stdout and stderr from the final command.
+    Return the stdout and stderr from the final command, and a list with
+    the resource usage of each command (see `stage_usage`). Raise
+    `subprocess.TimeoutExpired` if the pipeline does not finish in time.
+    If `max_memory` is given, each command's memory is capped at that
+    many MiB. If the current job is pinned to a CPU (see `PINNED_CPU`),
+    so is each command.
+
+    Each command runs in its own process group so that, when the
+    pipeline finishes or times out, everything it started (including
+    the children of a shell) can be killed at once. The commands are
+    reaped with `os.wait4`, as they exit (see `wait_child`), to get their
+    resource usage.
     """
+    cpu = PINNED_CPU.get()
+    preexec_fn = child_setup(max_memory, cpu)
+
+    # The input and the final output go through temporary files, so only
+    # the pipes between commands need to be drained while they run.
+    in_file = tempfile.TemporaryFile()
+    in_file.write(input.encode())
+    in_file.seek(0)
+    out_file = tempfile.TemporaryFile()
+    err_file = tempfile.TemporaryFile()
+
     procs = []
-    for cmd in cmds:
-        last = len(procs) == len(cmds) - 1
-        proc = subprocess.Popen(
-            cmd,
-            shell=True,
-            text=True,
-            stdin=procs[-1].stdout if procs else subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE if last else subprocess.DEVNULL,
-        )
-        procs.append(proc)
+    waits = []
+
+    # Stage start and exit times are in seconds since the pipeline began.
+    began = time.perf_counter()
+
+    async def wait(proc, start):
+        status, ru, end = await wait_child(proc.pid)
+        proc.returncode = status
+        return stage_usage(ru, start, end - began, cpu)
 
     try:
-        # Send stdin and collect stdout.
-        procs[0].stdin.write(input)
-        procs[0].stdin.close()
-        return procs[-1].communicate(timeout=timeout)
+        stdin = in_file.fileno()
+        for i, cmd in enumerate(cmds):
+            last = i == len(cmds) - 1
+            if last:
+                stdout = out_file.fileno()
+            else:
+                read_fd, stdout = os.pipe()
+            argv = command_argv(cmd)
+            start = time.perf_counter() - began
+            popen_args = dict(
+                stdin=stdin,
+                stdout=stdout,
+                stderr=err_file.fileno() if last else subprocess.DEVNULL,
+                start_new_session=True,
+                preexec_fn=preexec_fn,
+            )
+            try:
+                try:
+                    proc = subprocess.Popen(argv or cmd, shell=not argv,
+                                            **popen_args)
+                except OSError:
+                    if not argv:
+                        raise
+                    # The program is missing or can't be run. Let the
+                    # shell report it (with status 127 or 126), so the
+                    # failure stays inside this run.
+                    proc = subprocess.Popen(cmd, shell=True, **popen_args)
+            finally:
+                # The child has its own copies of the pipe ends.
+                if not last:
+                    os.close(stdout)
+                if i > 0:
+                    os.close(stdin)
+            procs.append(proc)
+            waits.append(asyncio.ensure_future(wait(proc, start)))
+            if not last:
+                stdin = read_fd
+
+        # Shielded so that, on a timeout, the killed commands are still
+        # reaped by their waits below.
+        try:
+            usage = await asyncio.wait_for(
+                asyncio.shield(asyncio.gather(*waits)), timeout,
+            )
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(cmds, timeout)
+
+        out_file.seek(0)
+        err_file.seek(0)
+        return out_file.read().decode(), err_file.read().decode(), usage
     finally:
         for proc in procs:
-            proc.kill()
+            kill_group(proc)
+        if waits:
+            await asyncio.gather(*waits, return_exceptions=True)
+        for f in (in_file, out_file, err_file):
+            f.close()
 
 
 def compare_output(o1, o2, ε=0.0):
@@ -55,10 +323,63 @@ def compare_output(o1, o2, ε=0.0):
     return all(my_compare(x, y) for x, y in zip(o1.split(), o2.split()))
 
 
-def run_bench(pipeline, fn, timeout):
-    """Run a single benchmark pipeline.
+# Hashes of the Python modules in each directory, by directory.
+MODULE_HASHES = {}
+
+
+def module_hash(path):
+    """Hash the source code of a Python script and of every module next
+    to it, any of which it might import.
+    """
+    here = os.path.dirname(os.path.abspath(path))
+    if here not in MODULE_HASHES:
+        h = hashlib.sha256()
+        for name in sorted(glob.glob(os.path.join(here, '*.py'))):
+            h.update(os.path.basename(name).encode())
+            with open(name, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        MODULE_HASHES[here] = h.hexdigest()
+    return MODULE_HASHES[here]
+
+
+def tool_versions(cmds):
+    """Identify the versions of the tools a pipeline runs, as a list of
+    `(path, version)` pairs. These are the programs named at the start
+    of each command and any arguments that name existing files (such as
+    the scripts given to an interpreter). A Python script's version is a
+    hash of its source and the modules next to it (see `module_hash`);
+    anything else's is its modification time.
+    """
+    out = []
+    for cmd in cmds:
+        try:
+            words = shlex.split(cmd)
+        except ValueError:
+            continue
+        for i, word in enumerate(words):
+            path = shutil.which(word) if i == 0 else word
+            if path and os.path.isfile(path):
+                if path.endswith('.py'):
+                    out.append((path, module_hash(path)))
+                else:
+                    out.append((path, os.stat(path).st_mtime_ns))
+    return out
+
+
+def cache_key(cmds, in_data, timeout, max_memory=None):
+    """Compute the result cache key for running a benchmark.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([cmds, timeout, max_memory,
+                         tool_versions(cmds)]).encode())
+    h.update(b'\0')
+    h.update(in_data.encode())
+    return h.hexdigest()
+
+
+def load_bench(fn):
+    """Load a benchmark file. Return its contents and its arguments.
     """
-    # Load the benchmark.
     with open(fn) as f:
         in_data = f.read()
 
@@ -66,12 +387,494 @@ def run_bench(pipeline, fn, timeout):
     match = re.search(ARGS_RE, in_data)
     args = match.group(1) if match else ''
 
-    # Run pipeline.
-    cmds = [
-        c.format(args=args)
-        for c in pipeline
+    return in_data, args
+
+
+def pipe_time(usage):
+    """Get the wall-clock time a pipeline took from its stages' usage.
+    """
+    return max(u['end'] for u in usage)
+
+
+def shift_usage(usage, offset):
+    """Shift the start and exit times of stages by some seconds.
+    """
+    return [dict(u, start=u['start'] + offset, end=u['end'] + offset)
+            for u in usage]
+
+
+class SharedPrefixes:
+    """Run several pipelines on the same input, with the same timeout,
+    running the leading stages they have in common only once.
+
+    A prefix of commands is shared if it comes before the last stage in
+    at least two of the pipelines (with the same memory limit). Its
+    output is computed once, by running it as a pipeline of its own
+    (which may itself start with a shorter shared prefix), and then fed
+    into the remaining stages of each pipeline. The usage of the shared
+    stages is reported for every pipeline that uses them, and the
+    remaining stages are timed as if they started when the prefix
+    finished.
+    """
+
+    def __init__(self, pipelines, run_pipe=run_pipe):
+        self._run_pipe = run_pipe
+        counts = collections.Counter(
+            (max_memory, tuple(cmds[:k]))
+            for cmds, max_memory in pipelines
+            for k in range(1, len(cmds))
+        )
+        self.shared = {key for key, count in counts.items() if count > 1}
+        self.outputs = {}
+
+    async def run_pipe(self, cmds, input, timeout, max_memory=None):
+        """Run one of the pipelines, like `run_pipe`.
+        """
+        for k in range(len(cmds) - 1, 0, -1):
+            key = (max_memory, tuple(cmds[:k]))
+            if key in self.shared:
+                break
+        else:
+            return await self._run_pipe(cmds, input, timeout, max_memory)
+
+        if key not in self.outputs:
+            self.outputs[key] = asyncio.ensure_future(
+                self.run_pipe(cmds[:k], input, timeout, max_memory)
+            )
+        prefix_out, _, prefix_usage = await asyncio.shield(self.outputs[key])
+
+        # The rest of the pipeline gets whatever time the prefix left.
+        elapsed = pipe_time(prefix_usage)
+        if elapsed >= timeout:
+            raise subprocess.TimeoutExpired(cmds, timeout)
+        stdout, stderr, usage = await self._run_pipe(
+            cmds[k:], prefix_out, timeout - elapsed, max_memory,
+        )
+        return stdout, stderr, prefix_usage + shift_usage(usage, elapsed)
+
+
+# The example passes that warm workers can run, when they are invoked as
+# `python3 path/to/examples/PASS.py ARGS...`.
+WARM_PASSES = {'lvn.py', 'tdce.py', 'to_ssa.py', 'from_ssa.py', 'df.py',
+               'dom.py', 'bril_opt.py'}
+PYTHON_RE = r'python(3(\.\d+)*)?$'
+
+
+def warm_pass(cmd):
+    """Check whether a command runs one of the example passes in a way a
+    warm worker can handle. If so, return the path of the script and its
+    arguments; otherwise, return None.
+
+    The command must run the same Python interpreter as Brench itself,
+    with no shell features or interpreter options.
+    """
+    argv = command_argv(cmd)
+    if not argv or len(argv) < 2 or not re.match(PYTHON_RE,
+                                                 os.path.basename(argv[0])):
+        return None
+    python = shutil.which(argv[0])
+    if not python or \
+            os.path.realpath(python) != os.path.realpath(sys.executable):
+        return None
+    script = argv[1]
+    examples = os.path.dirname(os.path.abspath(script))
+    if os.path.basename(script) not in WARM_PASSES or \
+            not os.path.isfile(script) or \
+            not os.path.isfile(os.path.join(examples, 'form_blocks.py')):
+        return None
+    return script, argv[2:]
+
+
+def warm_worker(conn, scripts):
+    """The main loop of a warm worker process.
+
+    First, import each of the scripts as a module (without running it as
+    `__main__`) to load the modules it depends on. Then, repeatedly
+    receive a `(script, args, input)` job, run the script as `__main__`
+    with those arguments and with the input bytes as its stdin, and send
+    back its stdout and stderr (as bytes), its exit code, and the CPU time
+    it used. The worker exits when its connection closes.
+    """
+    for script in scripts:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+        name, _ = os.path.splitext(os.path.basename(script))
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+    code = {}
+    while True:
+        try:
+            script, args, data = conn.recv()
+        except EOFError:
+            return
+
+        # Compile each script once (and again if it changes). Like
+        # Python, name the script by its absolute path in tracebacks.
+        path = os.path.join(os.getcwd(), script)
+        key = path, os.stat(path).st_mtime_ns
+        if key not in code:
+            with open(path, 'rb') as f:
+                code[key] = compile(f.read(), path, 'exec')
+
+        out = io.BytesIO()
+        err = io.BytesIO()
+        streams = [
+            io.TextIOWrapper(io.BytesIO(data), encoding='utf-8'),
+            io.TextIOWrapper(out, encoding='utf-8'),
+            io.TextIOWrapper(err, encoding='utf-8'),
+        ]
+        sys.argv = [script] + list(args)
+        sys.stdin, sys.stdout, sys.stderr = streams
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        status = 0
+        try:
+            exec(code[key], {'__name__': '__main__', '__file__': path,
+                             '__builtins__': __builtins__})
+        except SystemExit as exc:
+            if exc.code is None:
+                status = 0
+            elif isinstance(exc.code, int):
+                status = exc.code
+            else:
+                print(exc.code, file=sys.stderr)
+                status = 1
+        except BaseException as exc:
+            # Leave this function out of the traceback.
+            traceback.print_exception(type(exc), exc,
+                                      exc.__traceback__.tb_next)
+            status = 1
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        sys.stdin = sys.__stdin__
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+        for stream in streams:
+            stream.flush()
+            stream.detach()  # Don't close the buffers.
+        conn.send((out.getvalue(), err.getvalue(), status, {
+            'user': after.ru_utime - before.ru_utime,
+            'sys': after.ru_stime - before.ru_stime,
+            'maxrss': after.ru_maxrss,
+        }))
+
+
+class WorkerDied(Exception):
+    """A warm worker exited without finishing its job.
+    """
+
+
+class WarmPool:
+    """A pool of warm worker processes that run example passes without
+    starting a new Python interpreter, and importing everything again,
+    for each one (see `warm_worker`).
+
+    A pipeline stage run by a worker reads all its input before it starts
+    and is reported with the worker's CPU time for the job and the
+    worker's peak RSS so far. A worker running a pinned job is pinned to
+    the same CPU for the job. A worker that times out is killed and
+    replaced, as is one that dies, in which case `WorkerDied` is raised.
+    """
+
+    def __init__(self, size, scripts):
+        self.ctx = multiprocessing.get_context('spawn')
+        self.scripts = sorted(set(scripts))
+        self.idle = [self._start() for _ in range(size)]
+        self.ready = asyncio.Semaphore(size)
+
+    def _start(self):
+        conn, child_conn = self.ctx.Pipe()
+        proc = self.ctx.Process(target=warm_worker,
+                                args=(child_conn, self.scripts), daemon=True)
+        proc.start()
+        child_conn.close()
+        return proc, conn
+
+    async def run(self, script, args, input, timeout):
+        """Run a pass script on the input (text) in a worker. Return its
+        stdout, stderr, and a list with the usage of the single stage, as
+        `run_pipe` does.
+        """
+        loop = asyncio.get_running_loop()
+
+        def call(conn):
+            conn.send((script, args, input.encode()))
+            return conn.recv()
+
+        async with self.ready:
+            proc, conn = self.idle.pop()
+            cpu = PINNED_CPU.get()
+            if cpu is not None:
+                os.sched_setaffinity(proc.pid, {cpu})
+            start = time.perf_counter()
+            job = loop.run_in_executor(None, call, conn)
+            try:
+                out, err, _, usage = await asyncio.wait_for(
+                    asyncio.shield(job), timeout,
+                )
+            except BaseException as exc:
+                # Kill the worker and wait for the job to notice.
+                proc.kill()
+                await asyncio.gather(job, return_exceptions=True)
+                proc.join()
+                conn.close()
+                self.idle.append(self._start())
+                if isinstance(exc, asyncio.TimeoutError):
+                    raise subprocess.TimeoutExpired([script] + args, timeout)
+                elif isinstance(exc, (EOFError, OSError)):
+                    raise WorkerDied()
+                raise
+            self.idle.append((proc, conn))
+
+        usage.update(start=0.0, end=time.perf_counter() - start, cpu=cpu)
+        return out.decode(), err.decode(), [usage]
+
+    def close(self):
+        for proc, conn in self.idle:
+            conn.close()
+            proc.join()
+
+
+def pooled(pool, run_pipe=run_pipe):
+    """Get a function like `run_pipe` that runs the stages recognized by
+    `warm_pass` in a `WarmPool`. The rest of the stages run as usual, in
+    pipelines of their own between the warm stages, each taking its
+    input from the previous one. Stages with a memory limit always run as
+    separate processes, as do stages whose worker dies.
+    """
+    async def pooled_run_pipe(cmds, input, timeout, max_memory=None):
+        usage = []
+        elapsed = 0.0
+        stderr = ''
+        i = 0
+        while i < len(cmds):
+            if elapsed >= timeout:
+                raise subprocess.TimeoutExpired(cmds, timeout)
+            warm = None if max_memory else warm_pass(cmds[i])
+            if warm:
+                try:
+                    input, stderr, use = await pool.run(*warm, input,
+                                                        timeout - elapsed)
+                except WorkerDied:
+                    input, stderr, use = await run_pipe(
+                        cmds[i:i + 1], input, timeout - elapsed,
+                    )
+                i += 1
+            else:
+                j = i + 1
+                while j < len(cmds) and (max_memory or
+                                         not warm_pass(cmds[j])):
+                    j += 1
+                input, stderr, use = await run_pipe(
+                    cmds[i:j], input, timeout - elapsed, max_memory,
+                )
+                i = j
+            usage += shift_usage(use, elapsed)
+            elapsed = pipe_time(usage)
+        return input, stderr, usage
+    return pooled_run_pipe
+
+
+async def run_bench(cmds, in_data, timeout, cache_dir=None,
+                    max_memory=None, run_pipe=run_pipe):
+    """Run a single benchmark pipeline, using `run_pipe` (or a function
+    like it). Return its stdout, stderr, and per-stage resource usage.
+
+    With a `cache_dir`, reuse a stored result if there is one. Results
+    are stored by a hash of the benchmark file's contents (which include
+    its `ARGS:`), the pipeline commands, the timeout and memory limit,
+    and the versions of the tools the pipeline runs (see
+    `tool_versions`). Only the output is stored, so the usage of a
+    reused result is None: nothing was measured. Timeouts are not
+    cached.
+    """
+    if not cache_dir:
+        return await run_pipe(cmds, in_data, timeout, max_memory)
+
+    key = cache_key(cmds, in_data, timeout, max_memory)
+    path = os.path.join(cache_dir, key[:2], key + '.json')
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        return entry['stdout'], entry['stderr'], None
+    except (OSError, ValueError, KeyError):
+        pass
+
+    stdout, stderr, usage = await run_pipe(cmds, in_data, timeout,
+                                           max_memory)
+
+    # Write atomically, in case of concurrent brench runs.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'stdout': stdout, 'stderr': stderr}, f)
+    os.replace(tmp, path)
+    return stdout, stderr, usage
+
+
+async def run_all(runs, keys, timeout, jobs, cache_dir=None, trials=1,
+                  warmup=0, share=True, done=None, warm=False, cpus=None):
+    """Run benchmarks, given as a list of `(file, run name)` pairs, with
+    at most `jobs` pipelines at a time.
+
+    Each pipeline runs `warmup` times, with results discarded, and then
+    `trials` times. Trials are interleaved: every pipeline runs once,
+    and that round finishes, before any pipeline runs again, so that
+    drift in the machine's performance affects all runs alike. With
+    `share`, the leading stages that runs have in common are run once
+    for each benchmark in each trial (see `SharedPrefixes`). With
+    `warm`, the example passes run in a `WarmPool` of `jobs` workers.
+    With a list of `cpus`, each pipeline is pinned to one of them that
+    no other pipeline is using.
+
+    Return a dict mapping the `(file, run name)` pairs to lists of
+    `(stdout, stderr, status, seconds, usage)` tuples, one per trial,
+    where the status is None or `'timeout'` and the usage is a list of
+    per-stage resource usage (see `stage_usage`). As soon as all the
+    trials for a pair are finished, call `done` with the pair and its
+    list.
+    """
+    sem = asyncio.Semaphore(jobs)
+
+    # Each job talking to a warm worker occupies a thread.
+    asyncio.get_running_loop().set_default_executor(
+        futures.ThreadPoolExecutor(max_workers=jobs)
+    )
+
+    # Start workers for any example passes in the pipelines.
+    pool = None
+    if warm:
+        scripts = [w[0] for w in (
+            warm_pass(c.format(args=''))
+            for run in runs.values() for c in run['pipeline']
+        ) if w]
+        if scripts:
+            pool = WarmPool(jobs, scripts)
+    inner_run_pipe = pooled(pool) if pool else run_pipe
+
+    free_cpus = asyncio.Queue()
+    for cpu in cpus or []:
+        free_cpus.put_nowait(cpu)
+
+    async def limited_run_pipe(*args):
+        async with sem:
+            if not cpus:
+                return await inner_run_pipe(*args)
+            cpu = await free_cpus.get()
+            token = PINNED_CPU.set(cpu)
+            try:
+                return await inner_run_pipe(*args)
+            finally:
+                PINNED_CPU.reset(token)
+                free_cpus.put_nowait(cpu)
+
+    results = {key: [None] * trials for key in keys}
+    finished = collections.Counter()
+
+    # Group the runs for each file, keeping the order they were given in.
+    names = collections.OrderedDict()
+    for fn, name in keys:
+        names.setdefault(fn, []).append(name)
+
+    async def run_one(key, trial, in_data, cmds, max_memory, pipe):
+        try:
+            stdout, stderr, usage = await run_bench(
+                cmds, in_data, timeout, cache_dir, max_memory, pipe,
+            )
+        except subprocess.TimeoutExpired:
+            res = '', '', 'timeout', None, None
+        else:
+            res = stdout, stderr, None, \
+                pipe_time(usage) if usage else None, usage
+
+        if trial >= 0:
+            results[key][trial] = res
+            finished[key] += 1
+            if finished[key] == trials and done:
+                done(key, results[key])
+
+    async def run_round(trial):
+        tasks = []
+        for fn, run_names in names.items():
+            in_data, args = load_bench(fn)
+            pipelines = [
+                ([c.format(args=args) for c in runs[name]['pipeline']],
+                 runs[name].get('max_memory'))
+                for name in run_names
+            ]
+            pipe = limited_run_pipe
+            if share:
+                pipe = SharedPrefixes(pipelines, limited_run_pipe).run_pipe
+            for name, (cmds, max_memory) in zip(run_names, pipelines):
+                tasks.append(run_one((fn, name), trial, in_data, cmds,
+                                     max_memory, pipe))
+        await asyncio.gather(*tasks)
+
+    # Warmup rounds are numbered from -warmup to -1. Each round finishes
+    # before the next one starts, so warmups never overlap measured
+    # trials and a run never competes with its own other trials; only
+    # the benchmarks and runs within a round run in parallel.
+    try:
+        for trial in range(-warmup, trials):
+            await run_round(trial)
+    finally:
+        if pool:
+            pool.close()
+    return results
+
+
+# Two-sided 95% critical values of Student's t distribution, indexed by
+# degrees of freedom. Beyond the table, the normal approximation is close
+# enough.
+T_95 = [
+    None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+    2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093,
+    2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045,
+    2.042,
+]
+
+
+def summarize(values):
+    """Compute the mean, median, standard deviation, and the half-width
+    of the 95% confidence interval of the mean for a list of numbers.
+    With a single value, the last two are None.
+    """
+    mean = statistics.mean(values)
+    median = statistics.median(values)
+    n = len(values)
+    if n < 2:
+        return mean, median, None, None
+    stddev = statistics.stdev(values)
+    t = T_95[n - 1] if n - 1 < len(T_95) else 1.960
+    return mean, median, stddev, t * stddev / n ** 0.5
+
+
+def format_num(x):
+    """Format a statistic for the CSV, or leave it empty if undefined.
+    """
+    return '' if x is None else '{:.10g}'.format(x)
+
+
+STAT_COLUMNS = ['mean', 'median', 'stddev', 'ci95']
+USAGE_COLUMNS = ['user', 'sys', 'maxrss', 'maxrss_stage']
+STAGE_COLUMNS = ['benchmark', 'run', 'trial', 'stage', 'command', 'start',
+                 'end', 'wall', 'user', 'sys', 'maxrss', 'cpu']
+
+
+def usage_columns(usage):
+    """Get the columns summarizing a pipeline's resource usage: the total
+    user and system CPU time over all stages, and the largest peak RSS of
+    any stage along with that stage's (1-based) position.
+    """
+    if not usage:
+        return [None] * len(USAGE_COLUMNS)
+    peak = max(range(len(usage)), key=lambda i: usage[i]['maxrss'])
+    return [
+        sum(u['user'] for u in usage),
+        sum(u['sys'] for u in usage),
+        usage[peak]['maxrss'],
+        peak + 1,
     ]
-    return run_pipe(cmds, in_data, timeout)
 
 
 def get_result(strings, extract_re):
@@ -84,14 +887,437 @@ def get_result(strings, extract_re):
     return None
 
 
+def write_stages(path, runs, results):
+    """Write a long-format table with a row for each stage of each trial
+    of each run, giving the stage's start and exit time (relative to the
+    start of the pipeline), its wall-clock time, and its resource usage.
+    The stage is given as the command that ran, with the benchmark's
+    arguments filled in. Write JSON lines if the filename ends in
+    `.jsonl`, and CSV otherwise. Timed-out trials are omitted.
+    """
+    jsonl = path.endswith('.jsonl')
+    with open(path, 'w', newline='') as f:
+        if not jsonl:
+            writer = csv.writer(f)
+            writer.writerow(STAGE_COLUMNS)
+        for (fn, name), trial_results in results.items():
+            bench = bench_name(fn)
+            _, args = load_bench(fn)
+            cmds = [c.format(args=args) for c in runs[name]['pipeline']]
+            for trial, res in enumerate(trial_results, 1):
+                for i, use in enumerate(res[4] or []):
+                    row = [
+                        bench, name, trial, i + 1, cmds[i],
+                        use['start'], use['end'], use['end'] - use['start'],
+                        use['user'], use['sys'], use['maxrss'],
+                        use.get('cpu'),
+                    ]
+                    if jsonl:
+                        json.dump(dict(zip(STAGE_COLUMNS, row)), f)
+                        f.write('\n')
+                    else:
+                        writer.writerow(row[:5] + [
+                            format_num(x) for x in row[5:10]
+                        ] + [row[10], '' if row[11] is None else row[11]])
+
+
+def bench_name(fn):
+    """Get the name of a benchmark from its filename.
+    """
+    bench, _ = os.path.splitext(os.path.basename(fn))
+    return bench
+
+
+class Reporter:
+    """Write result rows as the benchmarks finish, as CSV or JSON lines.
+
+    A run's output is checked against the first run's output for the same
+    benchmark, so a run's row is held back until the first run for its
+    benchmark has finished. Rows are flushed as they are written, so a
+    partial output file has every result finished so far. The `results`
+    dict maps each reported `(benchmark, run)` pair to its result, or to
+    the median of its trials' results if there are several.
+    """
+
+    def __init__(self, out, config, trials=1, usage=False, jsonl=False,
+                 header=True, cpu=False):
+        self.out = out
+        self.config = config
+        self.first_run = next(iter(config['runs']), None)
+        self.trials = trials
+        self.usage = usage
+        self.cpu = cpu
+        self.jsonl = jsonl
+        self.first_outs = {}
+        self.pending = collections.defaultdict(list)
+        self.results = {}
+
+        if not jsonl:
+            self.writer = csv.writer(out)
+            if header:
+                header = ['benchmark', 'run', 'result']
+                if trials > 1:
+                    header += STAT_COLUMNS + ['time_' + c
+                                              for c in STAT_COLUMNS]
+                if usage:
+                    header += USAGE_COLUMNS
+                if cpu:
+                    header.append('cpu')
+                self.writer.writerow(header)
+                out.flush()
+
+    def add(self, key, runs, report=True):
+        """Add the trial results for a `(file, run name)` pair. Write its
+        row (and any rows that were waiting for it) unless `report` is
+        false, in which case only use it as the first run's output.
+        """
+        fn, name = key
+        if name == self.first_run:
+            self.first_outs[fn] = runs[0][0]
+            if report:
+                self.write(fn, name, runs)
+            for name, runs in self.pending.pop(fn, []):
+                self.write(fn, name, runs)
+        elif fn in self.first_outs:
+            self.write(fn, name, runs)
+        else:
+            self.pending[fn].append((name, runs))
+
+    def write(self, fn, name, runs):
+        """Check and summarize a run's results and write its row.
+        """
+        stdout, stderr, status, _, stages = runs[0]
+        status = next((r[2] for r in runs if r[2]), None)
+
+        # Check correctness.
+        ε = self.config.get('epsilon', 0.0)
+        if not compare_output(stdout, self.first_outs[fn], ε) and not status:
+            status = 'incorrect'
+
+        # Extract the figure of merit.
+        result = get_result([stdout, stderr], self.config['extract'])
+        if not result and not status:
+            status = 'missing'
+
+        # Summarize repeated trials.
+        stats = []
+        if self.trials > 1:
+            merits = None
+            times = None
+            if not status:
+                times = [r[3] for r in runs]
+                merits = [get_result([r[0], r[1]], self.config['extract'])
+                          for r in runs]
+                try:
+                    merits = [float(m) for m in merits]
+                except (TypeError, ValueError):
+                    merits = None
+            for values in (merits, times):
+                if values:
+                    stats += summarize(values)
+                else:
+                    stats += [None] * len(STAT_COLUMNS)
+
+        # Report the result, with the CPU the final stage was pinned to.
+        cpu = stages[-1].get('cpu') if stages else None
+        bench = bench_name(fn)
+        median = stats[1] if stats else None
+        self.results[(bench, name)] = status if status else \
+            result if median is None else format_num(median)
+        if self.jsonl:
+            row = {
+                'benchmark': bench,
+                'run': name,
+                'result': status if status else result,
+                'status': status,
+                'value': result,
+                'times': [r[3] for r in runs],
+                'stages': stages,
+            }
+            if self.trials > 1:
+                cols = STAT_COLUMNS + ['time_' + c for c in STAT_COLUMNS]
+                row.update(zip(cols, stats))
+            if self.usage:
+                row.update(zip(USAGE_COLUMNS, usage_columns(stages)))
+            if self.cpu:
+                row['cpu'] = cpu
+            json.dump(row, self.out)
+            self.out.write('\n')
+        else:
+            self.writer.writerow([
+                bench,
+                name,
+                status if status else result,
+            ] + [format_num(x) for x in stats + (
+                usage_columns(stages) if self.usage else []
+            ) + ([cpu] if self.cpu else [])])
+        self.out.flush()
+
+
+def parse_results(lines, jsonl):
+    """Parse lines of CSV or JSON lines output into a dict mapping
+    `(benchmark, run)` pairs to results (or None for raw shard output).
+    With repeated trials, the result is the median over the trials, as
+    in `Reporter.results`.
+    """
+    if jsonl:
+        rows = (json.loads(line) for line in lines if line.strip())
+    else:
+        rows = csv.DictReader(lines)
+    return {(row['benchmark'], row['run']): row_result(row) for row in rows}
+
+
+def row_result(row):
+    """Get the result from a row of output: the median if it has one,
+    and otherwise the `result` column.
+    """
+    median = row.get('median')
+    return row.get('result') if median in (None, '') else median
+
+
+def load_results(path):
+    """Read a CSV or JSON lines (if the name ends in `.jsonl`) result file
+    into a dict like `parse_results`.
+    """
+    with open(path, newline='') as f:
+        return parse_results(f.read().splitlines(), path.endswith('.jsonl'))
+
+
+def read_partial(path, jsonl):
+    """Read the results already reported in a partial output file, as a
+    dict like `parse_results`. Drop any incomplete last line, left by an
+    interrupted run, from the file.
+    """
+    try:
+        with open(path, newline='') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return {}
+    if text and not text.endswith('\n'):
+        text = text[:text.rfind('\n') + 1]
+        with open(path, 'w', newline='') as f:
+            f.write(text)
+    return parse_results(text.splitlines(), jsonl)
+
+
+def parse_threshold(ctx, param, value):
+    """Parse a `--threshold` percentage, like `2%` or `2`, into a ratio.
+    """
+    try:
+        return float(value.rstrip('%')) / 100
+    except ValueError:
+        raise click.BadParameter('expected a percentage, e.g., 2%')
+
+
+def geomean(values):
+    """Compute the geometric mean of a list of positive numbers.
+    """
+    return math.exp(sum(math.log(v) for v in values) / len(values))
+
+
+def to_number(result):
+    """Convert a result to a number, or None if it's a status.
+    """
+    try:
+        return float(result)
+    except (TypeError, ValueError):
+        return None
+
+
+def check_baseline(results, baseline, threshold):
+    """Compare results against a baseline, both dicts mapping
+    `(benchmark, run)` pairs to results, and report to stderr.
+
+    Each benchmark and run present in both gets a ratio of the new result
+    to the old one; lower is better. Report the geometric mean ratio for
+    each run, and flag any result that is worse than the baseline by more
+    than `threshold` (a ratio) or that has a new status (`incorrect`,
+    `timeout`, or `missing`). Return the number of flagged results.
+    """
+    ratios = collections.defaultdict(list)
+    flagged = 0
+    for key, new in sorted(results.items()):
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        new_num, old_num = to_number(new), to_number(old)
+        if new_num is None:
+            if new != old:
+                print('new {}: {} {} (was {})'.format(new, *key, old),
+                      file=sys.stderr)
+                flagged += 1
+        elif old_num is not None and old_num > 0 and new_num > 0:
+            ratio = new_num / old_num
+            ratios[key[1]].append(ratio)
+            if ratio > 1 + threshold:
+                print('regression: {} {} {} -> {} ({:.2f}x)'.format(
+                    *key, old, new, ratio,
+                ), file=sys.stderr)
+                flagged += 1
+
+    for run, rs in ratios.items():
+        print('geomean({}) = {:.2f}'.format(run, geomean(rs)),
+              file=sys.stderr)
+    return flagged
+
+
+class ShardReporter:
+    """Write the raw results of a shard of a benchmark batch as JSON
+    lines, for `brench-merge` to check and summarize. Each line records a
+    run's stdout, stderr, status, time, and stage usage for each trial,
+    along with the benchmark file, its position in the batch, and the
+    number of files in the batch.
+    """
+
+    def __init__(self, out, files):
+        self.out = out
+        self.index = {fn: i for i, fn in enumerate(files)}
+
+    def add(self, key, runs, report=True):
+        fn, name = key
+        json.dump({
+            'benchmark': bench_name(fn),
+            'run': name,
+            'file': fn,
+            'index': self.index[fn],
+            'files': len(self.index),
+            'trials': [
+                dict(zip(('stdout', 'stderr', 'status', 'time', 'stages'), r))
+                for r in runs
+            ],
+        }, self.out)
+        self.out.write('\n')
+        self.out.flush()
+
+
+def parse_shard(ctx, param, value):
+    """Parse a `--shard I/N` option into a pair of integers.
+    """
+    if value is None:
+        return None
+    try:
+        index, count = (int(n) for n in value.split('/'))
+    except ValueError:
+        raise click.BadParameter('expected I/N, e.g., 1/4')
+    if not 1 <= index <= count:
+        raise click.BadParameter('shard I/N needs 1 <= I <= N')
+    return index, count
+
+
+def load_times(path):
+    """Read the mean wall-clock time of each `(benchmark, run)` from a
+    previous JSON lines result file, either from `brench --jsonl` or
+    from a shard.
+    """
+    times = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if 'trials' in row:
+                secs = [t['time'] for t in row['trials']]
+            else:
+                secs = row.get('times') or []
+            secs = [t for t in secs if t is not None]
+            if secs:
+                times[(row['benchmark'], row['run'])] = sum(secs) / len(secs)
+    return times
+
+
+def shard_keys(keys, index, count, times=None):
+    """Deterministically pick shard `index` (from 1) of `count` out of a
+    list of `(file, run name)` pairs.
+
+    Without `times`, deal the pairs out in turn. With a dict of previous
+    times per `(benchmark, run)`, balance the shards' total time instead:
+    assign the pairs from longest to shortest, each to the shard with the
+    least time so far. Pairs with no previous time count as the average.
+    """
+    if not times:
+        return keys[index - 1::count]
+
+    default = sum(times.values()) / len(times)
+    cost = {key: times.get((bench_name(key[0]), key[1]), default)
+            for key in keys}
+    order = sorted(range(len(keys)), key=lambda i: (-cost[keys[i]], i))
+    loads = [0.0] * count
+    mine = set()
+    for i in order:
+        shard = min(range(count), key=lambda s: (loads[s], s))
+        loads[shard] += cost[keys[i]]
+        if shard == index - 1:
+            mine.add(i)
+    return [key for i, key in enumerate(keys) if i in mine]
+
+
 @click.command()
 @click.option('-j', '--jobs', default=None, type=int,
-              help='parallel threads to use (default: suitable for machine)')
+              help='parallel jobs to run (default: one per CPU)')
+@click.option('-n', '--trials', default=1, type=click.IntRange(min=1),
+              help='measured runs of each pipeline, summarized in the CSV')
+@click.option('-w', '--warmup', default=0, type=click.IntRange(min=0),
+              help='unmeasured runs of each pipeline before the trials')
+@click.option('--share/--no-share', default=True,
+              help='run leading stages common to several runs only once')
+@click.option('--warm', is_flag=True,
+              help='run example passes in warm Python worker processes')
+@click.option('--pin', is_flag=True,
+              help='pin each job to its own CPU and report which one')
+@click.option('--idle-siblings', is_flag=True,
+              help='with --pin, use one hyperthread per physical core')
+@click.option('-u', '--usage', is_flag=True,
+              help='report CPU time and peak memory of each run')
+@click.option('--stages', 'stages_path', default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help='write per-stage timing to this CSV (or .jsonl) file')
+@click.option('-o', '--output', 'out_path', default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help='write results to this file instead of stdout')
+@click.option('--jsonl', is_flag=True,
+              help='write results as JSON lines (default for .jsonl files)')
+@click.option('--resume', is_flag=True,
+              help='skip benchmarks already in the output file')
+@click.option('--baseline', 'baseline_path', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='compare results to this earlier CSV (or .jsonl) file')
+@click.option('--threshold', default='2%', callback=parse_threshold,
+              help='slowdown over the baseline to flag (default: 2%)')
+@click.option('--shard', default=None, callback=parse_shard, metavar='I/N',
+              help='run only part I of N of the benchmarks, for brench-merge')
+@click.option('--balance', 'balance_path', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='balance shards by the times in this JSONL result file')
+@click.option('--cache', 'cache_dir', default=None,
+              type=click.Path(file_okay=False),
+              help='reuse results stored in this directory')
 @click.argument('config_path', metavar='CONFIG', type=click.Path(exists=True))
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
-def brench(config_path, files, jobs):
+def brench(config_path, files, jobs, trials, warmup, share, warm, pin,
+           idle_siblings, usage, stages_path, out_path, jsonl, resume,
+           baseline_path, threshold, shard, balance_path, cache_dir):
     """Run a batch of benchmarks and emit a CSV of results.
     """
+    if cache_dir and (trials > 1 or warmup):
+        raise click.UsageError('--cache cannot be used with repeated trials')
+    if resume and not out_path:
+        raise click.UsageError('--resume requires --output')
+    if balance_path and not shard:
+        raise click.UsageError('--balance requires --shard')
+    if baseline_path and shard:
+        raise click.UsageError('use --baseline with brench-merge, not --shard')
+    if idle_siblings and not pin:
+        raise click.UsageError('--idle-siblings requires --pin')
+
+    # Pin jobs to CPUs, by default using all of them.
+    cpus = None
+    if pin:
+        if not hasattr(os, 'sched_setaffinity'):
+            raise click.UsageError('--pin is not supported on this platform')
+        cpus = pinnable_cpus(idle_siblings)
+        jobs = min(jobs or len(cpus), len(cpus))
+    jsonl = jsonl or bool(out_path and out_path.endswith('.jsonl'))
+
     with open(config_path) as f:
         config = tomlkit.loads(f.read())
 
@@ -100,48 +1326,414 @@ def brench(config_path, files, jobs):
         files = glob.glob(config['benchmarks'])
 
     timeout = config.get('timeout', 5)
-    ε = config.get('epsilon', 0.0)
-
-    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
-        # Submit jobs.
-        futs = {}
-        for fn in files:
-            for name, run in config['runs'].items():
-                futs[(fn, name)] = pool.submit(run_bench, run['pipeline'], fn,
-                                               timeout)
-
-        # Collect results and print CSV.
-        writer = csv.writer(sys.stdout)
-        writer.writerow(['benchmark', 'run', 'result'])
-        for fn in files:
-            first_out = None
-            for name in config['runs']:
-                try:
-                    stdout, stderr = futs[(fn, name)].result()
-                except subprocess.TimeoutExpired:
-                    stdout, stderr = '', ''
-                    status = 'timeout'
-                else:
-                    status = None
-
-                # Check correctness.
-                if first_out is None:
-                    first_out = stdout
-                elif not compare_output(stdout, first_out, ε) and not status:
-                    status = 'incorrect'
-
-                # Extract the figure of merit.
-                result = get_result([stdout, stderr], config['extract'])
-                if not result and not status:
-                    status = 'missing'
-
-                # Report the result.
-                bench, _ = os.path.splitext(os.path.basename(fn))
-                writer.writerow([
-                    bench,
-                    name,
-                    status if status else result,
-                ])
+    runs = config['runs']
+    first_run = next(iter(runs), None)
+
+    keys = [(fn, name) for fn in files for name in runs]
+
+    # Pick this shard's part of the batch. Shards leave correctness
+    # checking to `brench-merge`, so they need no reference runs.
+    if shard:
+        files = sorted(files)
+        keys = sorted(keys)
+        times = load_times(balance_path) if balance_path else None
+        keys = shard_keys(keys, *shard, times)
+        jsonl = True
+
+    # Skip results we already have. The first run still needs to be run
+    # for any benchmark with other runs left, to check their output.
+    done = read_partial(out_path, jsonl) if resume else {}
+    todo = {key for key in keys if (bench_name(key[0]), key[1]) not in done}
+    refs = set()
+    if not shard:
+        refs = {(fn, first_run) for fn, _ in todo} - todo
+    keys = [key for key in keys if key in todo or key in refs]
+
+    if out_path:
+        out_file = open(out_path, 'a' if resume else 'w', newline='')
+    else:
+        out_file = contextlib.nullcontext(sys.stdout)
+    with out_file as out:
+        if shard:
+            reporter = ShardReporter(out, files)
+        else:
+            reporter = Reporter(out, config, trials, usage, jsonl,
+                                header=not (resume and out.tell()),
+                                cpu=pin)
+
+        # Run the benchmarks, reporting each as soon as it's done.
+        results = asyncio.run(run_all(
+            runs, keys, timeout, jobs or os.cpu_count() or 1, cache_dir,
+            trials, warmup, share,
+            lambda key, res: reporter.add(key, res, key not in refs), warm,
+            cpus,
+        ))
+
+    if stages_path:
+        write_stages(stages_path, runs,
+                     {k: v for k, v in results.items() if k not in refs})
+
+    if baseline_path:
+        done.update(reporter.results)
+        if check_baseline(done, load_results(baseline_path), threshold):
+            sys.exit(1)
+
+
+@click.command()
+@click.option('-u', '--usage', is_flag=True,
+              help='report CPU time and peak memory of each run')
+@click.option('-o', '--output', 'out_path', default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help='write results to this file instead of stdout')
+@click.option('--jsonl', is_flag=True,
+              help='write results as JSON lines (default for .jsonl files)')
+@click.option('--baseline', 'baseline_path', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='compare results to this earlier CSV (or .jsonl) file')
+@click.option('--threshold', default='2%', callback=parse_threshold,
+              help='slowdown over the baseline to flag (default: 2%)')
+@click.argument('config_path', metavar='CONFIG', type=click.Path(exists=True))
+@click.argument('shard_paths', metavar='SHARD...', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+def brench_merge(config_path, shard_paths, usage, out_path, jsonl,
+                 baseline_path, threshold):
+    """Combine the output of `brench --shard` runs into one set of
+    results.
+    """
+    jsonl = jsonl or bool(out_path and out_path.endswith('.jsonl'))
+
+    with open(config_path) as f:
+        config = tomlkit.loads(f.read())
+    runs = config['runs']
+
+    # Gather the trial results for each (file, run) pair.
+    results = {}
+    files = {}
+    for path in shard_paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                key = (row['file'], row['run'])
+                if key in results:
+                    raise click.ClickException(
+                        'duplicate result for {} in {}'.format(
+                            ' '.join(key), path))
+                results[key] = [
+                    (t['stdout'], t['stderr'], t['status'], t['time'],
+                     t['stages'])
+                    for t in row['trials']
+                ]
+                files[row['file']] = row['index']
+                total = row['files']
+
+    if results and len(files) < total:
+        raise click.ClickException('missing results for {} of {} files'
+                                   .format(total - len(files), total))
+    missing = [(fn, name) for fn in files for name in runs
+               if (fn, name) not in results]
+    if missing:
+        raise click.ClickException('missing results for {} runs, '
+                                   'including {}'.format(len(missing),
+                                                         ' '.join(missing[0])))
+    trials = {len(r) for r in results.values()}
+    if len(trials) > 1:
+        raise click.ClickException('shards ran different numbers of trials')
+
+    if out_path:
+        out_file = open(out_path, 'w', newline='')
+    else:
+        out_file = contextlib.nullcontext(sys.stdout)
+    with out_file as out:
+        pinned = any(t[4] and t[4][-1].get('cpu') is not None
+                     for r in results.values() for t in r)
+        reporter = Reporter(out, config, trials.pop() if trials else 1,
+                            usage, jsonl, cpu=pinned)
+        for fn in sorted(files, key=files.get):
+            for name in runs:
+                reporter.add((fn, name), results[(fn, name)])
+
+    if baseline_path:
+        if check_baseline(reporter.results, load_results(baseline_path),
+                          threshold):
+            sys.exit(1)
+
+
+# Commits are ordered by when they were made, if git knows the commit, and
+# otherwise by when they were first added to the history.
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    id INTEGER PRIMARY KEY,
+    rev TEXT UNIQUE NOT NULL,
+    added REAL NOT NULL,
+    committed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    commit_id INTEGER NOT NULL REFERENCES commits (id),
+    run TEXT NOT NULL,
+    benchmark TEXT NOT NULL,
+    result TEXT NOT NULL,
+    value REAL,
+    time REAL,
+    time_stddev REAL,
+    PRIMARY KEY (commit_id, run, benchmark)
+);
+CREATE INDEX IF NOT EXISTS results_series
+    ON results (run, benchmark, commit_id);
+"""
+
+# Names for the commands in turnt's hyperfine `bench.json` files, which
+# `benchmarks/summarize.py` uses too. Other commands are named by their
+# first word.
+BENCH_JSON_RUNS = {
+    'brili': r'\bbrili\b',
+    'brilirs': r'\bbrilirs\b',
+    'brilift-jit': r'\bbrilift -j',
+    'brilift-aot': r'^\./[^/]+ ',
+}
+
+
+def open_history(path):
+    """Open (and create, if needed) a benchmark history database.
+    """
+    db = sqlite3.connect(path)
+    db.executescript(HISTORY_SCHEMA)
+    return db
+
+
+def commit_time(rev):
+    """Get the time a git commit was made, as a Unix timestamp, or None if
+    `rev` is not a commit in the current repository.
+    """
+    try:
+        out = subprocess.run(
+            ['git', 'show', '-s', '--format=%ct', rev + '^{commit}', '--'],
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return float(out)
+
+
+def history_rows(path):
+    """Read a result file for the history database. Generate `(run,
+    benchmark, result, value, time, time_stddev)` tuples, where the time
+    is the mean wall-clock time in seconds and the last is its standard
+    deviation.
+
+    A `.csv` or `.jsonl` file is Brench output; the value is the result
+    (the median, with repeated trials), if it's a number. A `.json` file
+    is a hyperfine `bench.json` file from turnt's `bench` environment;
+    the value is the mean time.
+    """
+    if path.endswith('.json'):
+        with open(path) as f:
+            data = json.load(f)
+        bench, _ = os.path.basename(path).split('.', 1)
+        for res in data['results']:
+            for run, pat in BENCH_JSON_RUNS.items():
+                if re.search(pat, res['command']):
+                    break
+            else:
+                run = res['command'].split()[0]
+            yield (run, bench, str(res['mean']), res['mean'], res['mean'],
+                   res.get('stddev'))
+        return
+
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl'):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            if 'result' not in row:
+                raise click.ClickException(
+                    '{} is shard output; use brench-merge first'.format(path))
+            times = [t for t in row.get('times') or [] if t is not None]
+            yield (
+                row['run'], row['benchmark'], row['result'],
+                to_number(row_result(row)),
+                to_number(row.get('time_mean')) or
+                (sum(times) / len(times) if times else None),
+                to_number(row.get('time_stddev')) or
+                (statistics.stdev(times) if len(times) > 1 else None),
+            )
+
+
+def changepoints(series, threshold, window=3):
+    """Find the points where a series of `(rev, value)` pairs shifts to
+    a new level. A change happens at a point where the median of (up to)
+    `window` values starting there differs from the median of the
+    `window` values before it by more than `threshold` (a ratio). Generate
+    `(rev, before, after)` tuples.
+    """
+    values = [v for _, v in series]
+    i = 1
+    while i < len(values):
+        before = statistics.median(values[max(0, i - window):i])
+        after = statistics.median(values[i:i + window])
+        if before > 0 and abs(after / before - 1) > threshold:
+            yield series[i][0], before, after
+            i += window
+        else:
+            i += 1
+
+
+@click.group()
+@click.option('--db', 'db_path', default='brench.db', show_default=True,
+              type=click.Path(dir_okay=False),
+              help='the history database')
+@click.pass_context
+def brench_history(ctx, db_path):
+    """Keep a history of benchmark results across commits.
+    """
+    ctx.obj = open_history(db_path)
+
+
+@brench_history.command()
+@click.option('-c', '--commit', 'rev', default=None,
+              help='the commit the results are for (default: git HEAD)')
+@click.argument('paths', metavar='FILE...', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.pass_obj
+def ingest(db, rev, paths):
+    """Add Brench results (.csv or .jsonl) or hyperfine bench.json files
+    from turnt to the history. Results for the same commit, run, and
+    benchmark replace earlier ones.
+    """
+    if rev is None:
+        try:
+            rev = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], check=True,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            ).stdout.decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            raise click.UsageError('not in a git repository; use --commit')
+
+    with db:
+        now = time.time()
+        committed = commit_time(rev)
+        db.execute(
+            'INSERT OR IGNORE INTO commits (rev, added, committed) '
+            'VALUES (?, ?, ?)',
+            (rev, now, now if committed is None else committed),
+        )
+        (commit_id,), = db.execute('SELECT id FROM commits WHERE rev = ?',
+                                   (rev,))
+        count = 0
+        for path in paths:
+            for row in history_rows(path):
+                db.execute(
+                    'INSERT OR REPLACE INTO results VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?)', (commit_id,) + row,
+                )
+                count += 1
+    print('{} results for {}'.format(count, rev), file=sys.stderr)
+
+
+@brench_history.command()
+@click.option('-r', '--run', default=None, help='only this run')
+@click.option('-b', '--benchmark', default=None, help='only this benchmark')
+@click.pass_obj
+def trend(db, run, benchmark):
+    """Print each benchmark's results for each commit, in the order the
+    commits were made.
+    """
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['run', 'benchmark', 'commit', 'result', 'time'])
+    for row in db.execute(
+        'SELECT run, benchmark, rev, result, time FROM results '
+        'JOIN commits ON commits.id = commit_id '
+        'WHERE (?1 IS NULL OR run = ?1) AND (?2 IS NULL OR benchmark = ?2) '
+        'ORDER BY run, benchmark, committed, commit_id', (run, benchmark),
+    ):
+        writer.writerow(row[:4] + (format_num(row[4]),))
+
+
+@brench_history.command()
+@click.option('--base', 'base_run', default='baseline', show_default=True,
+              help='the run to compare the others to')
+@click.option('-c', '--commit', 'rev', default=None,
+              help='only this commit')
+@click.pass_obj
+def speedup(db, base_run, rev):
+    """Print the geometric mean speedup of each run over the base run, for
+    each commit. A benchmark's speedup is the base run's value divided by
+    the other run's value for the same commit.
+    """
+    speedups = collections.defaultdict(list)
+    for rev, run, ratio in db.execute(
+        'SELECT rev, r.run, b.value / r.value FROM results r '
+        'JOIN results b ON b.commit_id = r.commit_id '
+        'AND b.benchmark = r.benchmark AND b.run = ?1 '
+        'JOIN commits ON commits.id = r.commit_id '
+        'WHERE (?2 IS NULL OR rev = ?2) AND r.value > 0 AND b.value > 0 '
+        'ORDER BY committed, r.commit_id', (base_run, rev),
+    ):
+        speedups[(rev, run)].append(ratio)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['commit', 'run', 'speedup', 'benchmarks'])
+    for (rev, run), ratios in speedups.items():
+        writer.writerow([rev, run, format_num(geomean(ratios)), len(ratios)])
+
+
+@brench_history.command()
+@click.argument('old')
+@click.argument('new')
+@click.pass_obj
+def compare(db, old, new):
+    """Print the geometric mean speedup of each run from commit OLD to
+    commit NEW, over the benchmarks with results for both.
+    """
+    speedups = collections.defaultdict(list)
+    for run, ratio in db.execute(
+        'SELECT o.run, o.value / n.value FROM results o '
+        'JOIN results n ON n.run = o.run AND n.benchmark = o.benchmark '
+        'WHERE o.commit_id = (SELECT id FROM commits WHERE rev = ?) '
+        'AND n.commit_id = (SELECT id FROM commits WHERE rev = ?) '
+        'AND o.value > 0 AND n.value > 0', (old, new),
+    ):
+        speedups[run].append(ratio)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['run', 'speedup', 'benchmarks'])
+    for run, ratios in speedups.items():
+        writer.writerow([run, format_num(geomean(ratios)), len(ratios)])
+
+
+@brench_history.command('changepoints')
+@click.option('-r', '--run', default=None, help='only this run')
+@click.option('-b', '--benchmark', default=None, help='only this benchmark')
+@click.option('--threshold', default='5%', callback=parse_threshold,
+              help='the smallest change to report (default: 5%)')
+@click.option('-w', '--window', default=3, type=click.IntRange(min=1),
+              help='how many commits to compare on each side')
+@click.pass_obj
+def changepoints_command(db, run, benchmark, threshold, window):
+    """Print the commits where a benchmark's results moved to a new level,
+    comparing the median of the results for the commits before to those
+    from that commit on.
+    """
+    series = collections.defaultdict(list)
+    for run, bench, rev, value in db.execute(
+        'SELECT run, benchmark, rev, value FROM results '
+        'JOIN commits ON commits.id = commit_id '
+        'WHERE (?1 IS NULL OR run = ?1) AND (?2 IS NULL OR benchmark = ?2) '
+        'AND value IS NOT NULL '
+        'ORDER BY run, benchmark, committed, commit_id',
+        (run, benchmark),
+    ):
+        series[(run, bench)].append((rev, value))
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['run', 'benchmark', 'commit', 'before', 'after',
+                     'ratio'])
+    for (run, bench), points in series.items():
+        for rev, before, after in changepoints(points, threshold, window):
+            writer.writerow([run, bench, rev, format_num(before),
+                             format_num(after), format_num(after / before)])
 
 
 if __name__ == '__main__':
@@ -117,16 +117,29 @@ class CFG:
 
         colors = [WHITE] * self.n
 
-        def dfs_visit(node):
-            if colors[node] == WHITE:
-                colors[node] = GRAY
-                if pre:
-                    pre(node)
-                for v in edges[node]:
-                    dfs_visit(v)
-                colors[node] = BLACK
-                if post:
-                    post(node)
+        # Use an explicit stack of (node, successor iterator) pairs rather
+        # than recursion, so that huge graphs don't overflow the stack.
+        def dfs_visit(root):
+            if colors[root] != WHITE:
+                return
+            colors[root] = GRAY
+            if pre:
+                pre(root)
+            stack = [(root, iter(edges[root]))]
+            while stack:
+                node, it = stack[-1]
+                for v in it:
+                    if colors[v] == WHITE:
+                        colors[v] = GRAY
+                        if pre:
+                            pre(v)
+                        stack.append((v, iter(edges[v])))
+                        break
+                else:
+                    stack.pop()
+                    colors[node] = BLACK
+                    if post:
+                        post(node)
 
         for i in order:
             dfs_visit(i)
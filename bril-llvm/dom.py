@@ -3,86 +3,102 @@
 import sys
 import json
 from brilpy import *
-from functools import reduce
 
 class Dominators:
 
     def __init__(self, func):
         g = CFG(func)
 
-        # First compute dominators
-        # IMPORTANT: This computes, for each block, the set of blocks that dominate
-        # it, not the other way around
-        self.doms = []
-        self.doms.append(set([0])) # Entry block is special, it's its own dominator
-        for i in range(1,g.n):
-            self.doms.append(set(range(g.n)))
-
-        order = g.rpo()
+        # Find immediate dominators with the iterative algorithm from Cooper,
+        # Harvey, and Kennedy, "A Simple, Fast Dominance Algorithm": visit
+        # blocks reachable from the entry in reverse postorder, intersecting
+        # the dominator-tree paths of their processed predecessors by walking
+        # up from whichever one is later in the order.
+        order = []
+        g.dfs(order=[0], post=order.append)
+        order.reverse()
+        self.order = order
+        number = [-1] * g.n
+        for k, b in enumerate(order):
+            number[b] = k
+
+        self.idom = [None] * g.n
+        self.idom[0] = 0  # Entry block is special, it's its own dominator
 
         changed = True
         while changed:
             changed = False
             for i in order[1:]: # no one can dominate 0 except 0
-                d = {i}
-                if g.preds[i]:
-                    d |= reduce(set.intersection, [self.doms[p] for p in g.preds[i]], set(range(g.n)))
-
-                if d != self.doms[i]:
+                new_idom = None
+                for p in g.preds[i]:
+                    if self.idom[p] is None:
+                        continue  # Not processed yet (or unreachable).
+                    if new_idom is None:
+                        new_idom = p
+                        continue
+                    a, b = p, new_idom
+                    while a != b:
+                        while number[a] > number[b]:
+                            a = self.idom[a]
+                        while number[b] > number[a]:
+                            b = self.idom[b]
+                    new_idom = a
+
+                if new_idom != self.idom[i]:
                     changed = True
-                    self.doms[i] = d
-
-        # Compute the "other way around" (from above), that is, for each block, the
-        # set of blocks this block dominates
-        self.dom_by = []
-        for i in range(g.n):
-            self.dom_by.append(set())
-
-        for i,d in enumerate(self.doms):
-            for mbr in d:
-                self.dom_by[mbr].add(i)
-
-
-
-        # Compute the dominance tree
-        dt_parent = [None]
+                    self.idom[i] = new_idom
 
+        # Compute the dominance tree. The root is listed under `None`, and
+        # children appear in block order. Unreachable blocks are left out.
+        self.dom_tree = {None: [0]}
         for i in range(1, g.n):
-            for j in self.doms[i]:
-                if i != j:  # j strictly dominates i
-                    immed_dom = True
-                    for k in range(g.n):
-                        if k != j and k != i and j in self.doms[k] and k in self.doms[i]:
-                            immed_dom = False
-                            break
-                    if immed_dom:
-                        dt_parent.append(j)
-                        break
-
-        self.dom_tree = {}
-        for i,p in enumerate(dt_parent):
-            if p in self.dom_tree:
-                self.dom_tree[p].append(i)
-            else:
-                self.dom_tree[p] = [i]
-
-        # Compute dominance frontier
+            p = self.idom[i]
+            if p is not None:
+                if p in self.dom_tree:
+                    self.dom_tree[p].append(i)
+                else:
+                    self.dom_tree[p] = [i]
+
+        # Compute dominance frontier (Cytron et al.): a block is in the
+        # frontier of every block on the dominator-tree path from each of its
+        # predecessors up to, but not including, its immediate dominator.
+        # The entry has no immediate dominator, so the walk goes to the root.
         self.frontier = []
         for i in range(g.n):
             self.frontier.append(set())
 
-        for i,d in enumerate(self.doms):
-            # Union of dominators for this node's preds
-            pre_doms = reduce(set.union, [self.doms[p] for p in g.preds[i]], set())
-            # Subtract out strict dominators for this node
-            pre_doms = pre_doms.difference(self.doms[i].difference(set([i])))
-
-            # This node is in the frontier for the remaining nodes:
-            for p in pre_doms:
-                self.frontier[p].add(i)
-
-
-
+        for i in order:
+            stop = self.idom[i] if i != 0 else None
+            for p in g.preds[i]:
+                if self.idom[p] is None:
+                    continue  # Unreachable predecessor.
+                runner = p
+                while runner is not None and runner != stop:
+                    self.frontier[runner].add(i)
+                    runner = self.idom[runner] if runner != 0 else None
+
+        self._doms = None
+
+    @property
+    def doms(self):
+        # IMPORTANT: This is, for each block, the set of blocks that dominate
+        # it, not the other way around. It takes quadratic space, so it is
+        # only expanded from the idoms when someone asks.
+        if self._doms is None:
+            self._doms = [{i} for i in range(len(self.idom))]
+            for i in self.order[1:]:
+                self._doms[i] = self._doms[self.idom[i]] | {i}
+        return self._doms
+
+    @property
+    def dom_by(self):
+        # The "other way around" (from above), that is, for each block, the
+        # set of blocks this block dominates
+        dom_by = [set() for _ in self.idom]
+        for i, d in enumerate(self.doms):
+            for mbr in d:
+                dom_by[mbr].add(i)
+        return dom_by
 
 
 def main():
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+# Make a Bril program bigger, for measuring how compile time grows.
+#
+# Reads a program (in JSON) from stdin and writes it to stdout with the body
+# of every function repeated `k` times, where `k` is the first argument. Each
+# copy gets its own labels, and each `ret` except in the last copy jumps to
+# the start of the next copy instead, so every copy is reachable. The result
+# computes different things than the original; it is only meant for timing.
+
+import sys
+import json
+
+
+def scale_func(func, k):
+    labels = {i['label'] for i in func['instrs'] if 'label' in i}
+
+    def rename(lbl, c):
+        return lbl if c == 0 or lbl not in labels else '{}.scale.{}'.format(lbl, c)
+
+    instrs = []
+    for c in range(k):
+        if c > 0:
+            instrs.append({'label': 'scale.{}'.format(c)})
+        for inst in func['instrs']:
+            inst = dict(inst)
+            if 'label' in inst:
+                inst['label'] = rename(inst['label'], c)
+            elif inst['op'] == 'ret' and c < k - 1:
+                inst = {'op': 'jmp', 'labels': ['scale.{}'.format(c + 1)]}
+            elif 'labels' in inst:
+                inst['labels'] = [rename(lbl, c) for lbl in inst['labels']]
+            instrs.append(inst)
+    func['instrs'] = instrs
+
+
+def main():
+    k = int(sys.argv[1])
+    prog = json.load(sys.stdin)
+    for func in prog['functions']:
+        scale_func(func, k)
+    json.dump(prog, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
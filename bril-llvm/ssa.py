@@ -18,38 +18,35 @@ def to_ssa(prog):
         # we can't have a phi as the first instruction to disambiguate args
         if 'args' in func:
             if func['args']:
-                for a in func['args']:
-                    func['instrs'] = [{'op':'id', 'args':[a['name']], 'type':a['type'], 'dest':a['name']}] + \
-                                     func['instrs']
-                func['instrs'] = [{'label':'pre_entry'}] + func['instrs']
+                func['instrs'] = [{'label':'pre_entry'}] + \
+                                 [{'op':'id', 'args':[a['name']], 'type':a['type'], 'dest':a['name']}
+                                  for a in reversed(func['args'])] + \
+                                 func['instrs']
 
         # Next we need to canonicalize labels, in case any labels appear
-        # directly in a row, this would break things later
+        # directly in a row, this would break things later. Each label in a
+        # run is replaced by the first one; collect the renaming in one pass
+        # and then apply it to every jump in another.
+        canon = {}
+        instrs = []
         label_last = False
         last = None
-        i = 0
-        while i < len(func['instrs']):
-            inst = func['instrs'][i]
+        for inst in func['instrs']:
             if 'label' in inst:
                 if label_last:
-                    for j in func['instrs']:
-                        if 'labels' in j and inst['label'] in j['labels']:
-                            labels = []
-                            for lbl in j['labels']:
-                                if lbl == inst['label']:
-                                    labels.append(last['label'])
-                                else:
-                                    labels.append(lbl)
-                            j['labels'] = labels
-                    func['instrs'].pop(i)
-
-                else:
-                    i += 1
-                    last = inst
-                    label_last = True
+                    canon[inst['label']] = last['label']
+                    continue
+                last = inst
+                label_last = True
             else:
-                i += 1
                 label_last = False
+            instrs.append(inst)
+
+        if canon:
+            for j in instrs:
+                if 'labels' in j:
+                    j['labels'] = [canon.get(lbl, lbl) for lbl in j['labels']]
+        func['instrs'] = instrs
 
         # This last bit is just because even after the above, a valid bril
         # program could end with a label, but we don't want that (i.e., an empty
@@ -83,13 +80,15 @@ def to_ssa(prog):
         # Following pseudocode from Lesson 5 notes
         # ``Step one''
         for v,vdefs in defs.items():
+            vdefs_set = set(vdefs)
             for d in vdefs:
                 for b in domins.frontier[d]:
                     if v not in phis[b]:
                         phis[b][v] = {'op':'phi', 'args':[], 'labels':[]} # will handle dest/args later
 
-                    if b not in defs[v]:
-                        defs[v].append(b)
+                    if b not in vdefs_set:
+                        vdefs.append(b)
+                        vdefs_set.add(b)
 
         # ``Step two''
         stack = {}
@@ -156,16 +155,26 @@ def to_ssa(prog):
                         phis[s][v]['args'].append(stack[v][-1])
                         phis[s][v]['labels'].append(g.names[b])
 
-            if b in domins.dom_tree:
-                for b_dom in domins.dom_tree[b]:
-                    rename(b_dom)
+            return push_count
 
-            # pop all the names
+        # pop all the names
+        def pop_names(push_count):
             for var,count in push_count.items():
                 for j in range(count):
                     stack[var].pop()
 
-        rename(0)
+        # Walk the dominator tree in preorder with an explicit stack (of each
+        # block's pushed names and its remaining children), popping a block's
+        # names once all of its children are done.
+        walk = [(rename(0), iter(domins.dom_tree.get(0, [])))]
+        while walk:
+            push_count, children = walk[-1]
+            for b_dom in children:
+                walk.append((rename(b_dom), iter(domins.dom_tree.get(b_dom, []))))
+                break
+            else:
+                walk.pop()
+                pop_names(push_count)
 
 
         # Add labels to blocks missing labels, and add jumps to blocks that fall
@@ -185,10 +194,13 @@ def to_ssa(prog):
                 g.blocks[i-1].append({'op':'jmp', 'labels':[b[0]['label']]})
 
 
-        # Write all the blocks' instructions to a new "linear" function
+        # Write all the blocks' instructions to a new "linear" function,
+        # dropping unreachable blocks (the renaming never visits them, so they
+        # would still refer to the old variable names)
         newinstrs = []
         for i,b in enumerate(g.blocks):
-            newinstrs += b
+            if domins.idom[i] is not None:
+                newinstrs += b
 
         if 'op' not in newinstrs[-1] or newinstrs[-1]['op'] not in TERM:
             newinstrs.append({'op':'ret'});
@@ -5,32 +5,51 @@ human-editable representation of Bril programs. There are two commands:
 `bril2txt`, which takes a Bril program in its (canonical) JSON format and
 pretty-prints it in the text format, and `bril2json`, which parses the
 format and emits the ordinary JSON representation.
+
+The parser has two implementations: a hand-written recursive-descent
+parser (the default) and an LALR parser generated by Lark from `GRAMMAR`,
+which you can select with `bril2json --lark`.
 """
 
 import lark
 import sys
 import json
+import re
+import os
+import gc
+import contextlib
+import hashlib
+import pickle
+import sqlite3
+import time
+import array
+import struct
+import concurrent.futures
 
 __version__ = '0.0.1'
 
 
 # Text format parser.
 
+# The grammar for the Lark parser, which is LALR(1): keywords like
+# `const` are resolved by the contextual lexer, and the optional argument
+# list is spelled so that `()` has only one derivation. It accepts the
+# same language as the hand-written parser below.
 GRAMMAR = """
 start: (struct | func)*
 
 struct: STRUCT IDENT "=" "{" mbr* "}"
 mbr: IDENT ":" type ";"
 
-func: FUNC ["(" arg_list? ")"] [tyann] "{" instr* "}"
+func: FUNC ["(" arg_list ")"] [tyann] "{" instr* "}"
 arg_list: | arg ("," arg)*
 arg: IDENT ":" type
 ?instr: const | vop | eop | label
 
-const.4: IDENT [tyann] "=" "const" lit ";"
-vop.3: IDENT [tyann] "=" op ";"
-eop.2: op ";"
-label.1: LABEL ":"
+const: IDENT [tyann] "=" "const" lit ";"
+vop: IDENT [tyann] "=" op ";"
+eop: op ";"
+label: LABEL ":"
 
 op: IDENT (FUNC | LABEL | IDENT)*
 
@@ -61,6 +80,13 @@ COMMENT: /#.*/
 %ignore COMMENT
 """.strip()
 
+# The LALR parser is built once, when this module is imported. Lark
+# serializes the constructed parse table to a file in the system's
+# temporary directory (keyed by a hash of the grammar and options) and
+# loads it from there on subsequent imports instead of regenerating it.
+LALR_PARSER = lark.Lark(GRAMMAR, parser='lalr', maybe_placeholders=True,
+                        cache=True)
+
 
 def _pos(token):
     """Generate a position dict from a Lark token."""
@@ -211,14 +237,619 @@ class JSONTransformer(lark.Transformer):
         return 0
 
 
-def parse_bril(txt, include_pos=False):
+def lark_parse(txt, include_pos=False):
+    """Parse a Bril program with Lark and return its JSON data.
+    """
+    tree = LALR_PARSER.parse(txt)
+    return JSONTransformer(include_pos).transform(tree)
+
+
+# Hand-written parser. This accepts the same language as `GRAMMAR` but
+# goes straight from text to JSON data without building a parse tree.
+
+class ParseError(Exception):
+    """A syntax error in a Bril text program.
+    """
+
+    def __init__(self, msg, row, col):
+        super().__init__(msg, row, col)
+        self.msg = msg
+        self.row = row
+        self.col = col
+
+    def __str__(self):
+        return '{}:{}: {}'.format(self.row, self.col, self.msg)
+
+
+_IDENT = r'[_%A-Za-z][_%.A-Za-z0-9]*'
+_TOKEN_RE = re.compile(r"""
+    (?P<NEWLINE>\n)
+  | (?P<WS>[ \t\f\r]+)
+  | (?P<COMMENT>\#[^\n]*)
+  | (?P<IDENT>{ident})
+  | (?P<FUNC>@{ident})
+  | (?P<LABEL>\.{ident})
+  | (?P<FLOAT>[+-]?(?:\d+[eE][+-]?\d+|(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?))
+  | (?P<INT>[+-]?\d+)
+  | (?P<PUNCT>[=:;{{}}(),<>])
+  | (?P<ERROR>.)
+""".format(ident=_IDENT), re.VERBOSE)
+
+
+def tokenize(txt):
+    """Split Bril text into a list of `(kind, text, row, col)` tokens.
+
+    The kind is `IDENT`, `FUNC`, `LABEL`, `INT`, or `FLOAT`, or the
+    punctuation character itself. Keywords are lexed as identifiers;
+    the parser decides from context whether they are keywords. The list
+    ends with an `EOF` token.
+    """
+    tokens = []
+    row = 1
+    line_start = 0
+    for m in _TOKEN_RE.finditer(txt):
+        kind = m.lastgroup
+        if kind == 'NEWLINE':
+            row += 1
+            line_start = m.end()
+        elif kind == 'WS' or kind == 'COMMENT':
+            pass
+        elif kind == 'PUNCT':
+            tok = m.group()
+            tokens.append((tok, tok, row, m.start() - line_start + 1))
+        elif kind == 'ERROR':
+            raise ParseError('unexpected character {!r}'.format(m.group()),
+                             row, m.start() - line_start + 1)
+        else:
+            tokens.append((kind, m.group(), row, m.start() - line_start + 1))
+    tokens.append(('EOF', '', row, len(txt) - line_start + 1))
+    return tokens
+
+
+class Parser:
+    """A recursive-descent parser for the Bril text format.
+
+    Each `parse_*` method consumes the tokens for one grammar rule and
+    returns the same JSON data that `JSONTransformer` produces for it.
+    """
+
+    def __init__(self, txt, include_pos=False):
+        self.tokens = tokenize(txt)
+        self.idx = 0
+        self.include_pos = include_pos
+
+    def peek(self, offset=0):
+        return self.tokens[self.idx + offset]
+
+    def next(self):
+        tok = self.tokens[self.idx]
+        self.idx += 1
+        return tok
+
+    def error(self, tok, expected):
+        kind, text, row, col = tok
+        found = 'end of input' if kind == 'EOF' else repr(text)
+        raise ParseError('expected {}, found {}'.format(expected, found),
+                         row, col)
+
+    def expect(self, kind, expected=None):
+        tok = self.next()
+        if tok[0] != kind:
+            self.error(tok, expected or repr(kind))
+        return tok
+
+    def pos(self, tok):
+        return {'row': tok[2], 'col': tok[3]}
+
+    def parse(self):
+        structs = []
+        funcs = []
+        while True:
+            kind, text, _, _ = tok = self.peek()
+            if kind == 'EOF':
+                break
+            elif kind == 'FUNC':
+                funcs.append(self.parse_func())
+            elif kind == 'IDENT' and text == 'struct':
+                structs.append(self.parse_struct())
+            else:
+                self.error(tok, 'a function or struct')
+        if structs:
+            return {
+                'structs': structs,
+                'functions': funcs,
+            }
+        else:
+            return {
+                'functions': funcs,
+            }
+
+    def parse_struct(self):
+        self.next()  # `struct`
+        name = self.expect('IDENT', 'a struct name')[1]
+        self.expect('=')
+        self.expect('{')
+        mbrs = []
+        while self.peek()[0] != '}':
+            mbr_name = self.expect('IDENT', 'a member name')[1]
+            self.expect(':')
+            typ = self.parse_type()
+            self.expect(';')
+            mbrs.append({
+                'name': mbr_name,
+                'type': typ,
+            })
+        self.next()
+        return {
+            'name': name,
+            'mbrs': mbrs,
+        }
+
+    def parse_func(self):
+        name_tok = self.next()
+        args = []
+        if self.peek()[0] == '(':
+            self.next()
+            if self.peek()[0] != ')':
+                args.append(self.parse_arg())
+                while self.peek()[0] == ',':
+                    self.next()
+                    args.append(self.parse_arg())
+            self.expect(')')
+        typ = None
+        if self.peek()[0] == ':':
+            self.next()
+            typ = self.parse_type()
+        self.expect('{')
+        instrs = []
+        while self.peek()[0] != '}':
+            instrs.append(self.parse_instr())
+        self.next()
+
+        func = {
+            'name': name_tok[1][1:],  # Strip `@`.
+            'instrs': instrs,
+        }
+        if args:
+            func['args'] = args
+        if typ:
+            func['type'] = typ
+        if self.include_pos:
+            func['pos'] = self.pos(name_tok)
+        return func
+
+    def parse_arg(self):
+        name = self.expect('IDENT', 'an argument name')[1]
+        self.expect(':')
+        return {
+            'name': name,
+            'type': self.parse_type(),
+        }
+
+    def parse_type(self):
+        name = self.expect('IDENT', 'a type')[1]
+        if self.peek()[0] == '<':
+            self.next()
+            param = self.parse_type()
+            self.expect('>')
+            return {name: param}
+        else:
+            return name
+
+    def parse_instr(self):
+        tok = self.next()
+        kind = tok[0]
+        if kind == 'LABEL':
+            self.expect(':')
+            out = {
+                'label': tok[1][1:]  # Strip `.`.
+            }
+        elif kind != 'IDENT':
+            self.error(tok, 'an instruction or label')
+        elif self.peek()[0] in (':', '='):
+            # A value operation or constant, with destination `tok`.
+            typ = None
+            if self.peek()[0] == ':':
+                self.next()
+                typ = self.parse_type()
+            self.expect('=')
+            op_tok = self.next()
+            if op_tok[0] == 'IDENT' and op_tok[1] == 'const':
+                out = {
+                    'op': 'const',
+                    'dest': tok[1],
+                    'value': self.parse_lit(),
+                }
+            elif op_tok[0] == 'IDENT':
+                out = {'dest': tok[1]}
+                out.update(self.parse_op(op_tok))
+            else:
+                self.error(op_tok, 'an operation')
+            if typ:
+                out['type'] = typ
+            self.expect(';')
+        else:
+            # An effect operation.
+            out = self.parse_op(tok)
+            self.expect(';')
+        if self.include_pos:
+            out['pos'] = self.pos(tok)
+        return out
+
+    def parse_op(self, op_tok):
+        funcs = []
+        labels = []
+        args = []
+        while True:
+            kind, text, _, _ = self.peek()
+            if kind == 'IDENT':
+                args.append(text)
+            elif kind == 'FUNC':
+                funcs.append(text[1:])
+            elif kind == 'LABEL':
+                labels.append(text[1:])
+            else:
+                break
+            self.next()
+
+        out = {'op': op_tok[1]}
+        if args:
+            out['args'] = args
+        if funcs:
+            out['funcs'] = funcs
+        if labels:
+            out['labels'] = labels
+        return out
+
+    def parse_lit(self):
+        tok = self.next()
+        kind, text, _, _ = tok
+        if kind == 'INT':
+            return int(text)
+        elif kind == 'FLOAT':
+            return float(text)
+        elif kind == 'IDENT' and text in ('true', 'false'):
+            return text == 'true'
+        elif kind == 'IDENT' and text == 'nullptr':
+            return 0
+        else:
+            self.error(tok, 'a literal')
+
+
+def rd_parse(txt, include_pos=False):
+    """Parse a Bril program with the hand-written parser and return its
+    JSON data.
+    """
+    return Parser(txt, include_pos).parse()
+
+
+# Parser implementations, by the name used to select them.
+BACKENDS = {
+    'rd': rd_parse,
+    'lark': lark_parse,
+}
+
+
+# Parallel parsing. Top-level structs and functions are independent, so
+# a large program can be cut between them and the pieces parsed in
+# separate processes.
+
+# Programs smaller than this (in characters) are not worth the cost of
+# starting a process pool, by default.
+PARALLEL_MIN_SIZE = 1 << 20
+
+_BRACE_RE = re.compile(r'[{}]|#[^\n]*')
+
+
+def toplevel_bounds(txt):
+    """Find the offsets in `txt` just after each top-level struct or
+    function, i.e., after every `}` that closes an outermost brace.
+
+    Return None if the braces are unbalanced.
+    """
+    bounds = []
+    depth = 0
+    for m in _BRACE_RE.finditer(txt):
+        c = m.group()
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                bounds.append(m.end())
+            elif depth < 0:
+                return None
+    return bounds if depth == 0 else None
+
+
+def split_toplevel(txt, bounds, count=None):
+    """Cut Bril text into at most `count` pieces of similar size at the
+    top-level struct and function boundaries in `bounds` (as found by
+    `toplevel_bounds`). With no `count`, cut at every boundary.
+
+    Generate `(row, text)` pairs, where `row` is the number of lines
+    before the piece in `txt`. Each piece is padded with spaces so its
+    first line has the same columns as in `txt`.
+    """
+    target = len(txt) // count + 1 if count else 0
+    start = 0
+    row = 0
+    for end in bounds + [len(txt)]:
+        if end - start < target and end != len(txt):
+            continue
+        line_start = txt.rfind('\n', 0, start) + 1
+        yield row, ' ' * (start - line_start) + txt[start:end]
+        row += txt.count('\n', start, end)
+        start = end
+
+
+def shift_rows(item, rows):
+    """Move the source positions in a parsed struct or function (and its
+    instructions) down by `rows` lines.
+    """
+    if 'pos' in item:
+        item['pos']['row'] += rows
+    for instr in item.get('instrs', ()):
+        if 'pos' in instr:
+            instr['pos']['row'] += rows
+
+
+def _parse_piece(piece):
+    row, txt, include_pos, backend = piece
+    data = BACKENDS[backend](txt, include_pos)
+    if include_pos and row:
+        for func in data['functions']:
+            shift_rows(func, row)
+    return data
+
+
+def parallel_parse(txt, include_pos=False, backend='rd', jobs=None,
+                   min_size=PARALLEL_MIN_SIZE):
+    """Parse a Bril program in a pool of `jobs` processes (by default,
+    one per available core) and return its JSON data. Programs shorter
+    than `min_size` characters are parsed serially.
+    """
+    if jobs is None:
+        jobs = len(os.sched_getaffinity(0)) \
+            if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    bounds = toplevel_bounds(txt) if len(txt) >= min_size else None
+    if jobs <= 1 or bounds is None:
+        return BACKENDS[backend](txt, include_pos)
+
+    pieces = [(row, piece, include_pos, backend)
+              for row, piece in split_toplevel(txt, bounds, jobs * 4)]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            return merge_pieces(pool.map(_parse_piece, pieces))
+    except (ParseError, lark.exceptions.LarkError):
+        # Parse serially for an error message with the right position.
+        return BACKENDS[backend](txt, include_pos)
+
+
+def merge_pieces(datas):
+    """Combine the JSON data for consecutive pieces of a program.
+    """
+    structs = []
+    funcs = []
+    for data in datas:
+        structs += data.get('structs', [])
+        funcs += data['functions']
+    if structs:
+        return {
+            'structs': structs,
+            'functions': funcs,
+        }
+    else:
+        return {
+            'functions': funcs,
+        }
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Disable the cyclic garbage collector in a `with` block.
+
+    Building many small containers at once makes the collector run over
+    and over, to no avail, so bulk loaders pause it.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# Incremental parsing. When a program is edited, usually only a few of
+# its functions change. This caches the parse of each top-level struct
+# and function in an SQLite database, keyed by a hash of its text (and of
+# the parser's own source, so editing the parser invalidates old
+# entries), so only the changed ones need to be parsed again. A parse
+# looks up all its pieces in one query and marks them used in one batch.
+# The database keeps a running total of its size, and when that grows
+# beyond `BRIL_PARSE_CACHE_SIZE` bytes (default: 256 MiB), the least
+# recently used entries are evicted.
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+_SOURCE_HASH = None
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pieces (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pieces_used ON pieces (used);
+CREATE TABLE IF NOT EXISTS total (
+    size INTEGER NOT NULL
+);
+INSERT INTO total SELECT 0 WHERE NOT EXISTS (SELECT * FROM total);
+"""
+
+# How many keys to put in one SQL statement (older SQLite versions
+# allow at most 999 parameters).
+_CACHE_BATCH = 500
+
+
+def default_cache_dir():
+    """Get the directory for the parse cache: `bril/parse` in the user's
+    cache directory.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bril', 'parse')
+
+
+def source_hash():
+    """Hash the source code of this module, which contains the grammar
+    and both parser implementations.
+    """
+    global _SOURCE_HASH
+    if _SOURCE_HASH is None:
+        with open(os.path.abspath(__file__), 'rb') as f:
+            _SOURCE_HASH = hashlib.sha256(f.read()).hexdigest()
+    return _SOURCE_HASH
+
+
+def _cache_key(piece, include_pos):
+    key = '{}\0{}\0{}'.format(source_hash(), int(include_pos), piece)
+    return hashlib.sha256(key.encode('utf8')).hexdigest()
+
+
+def _batches(items):
+    items = list(items)
+    for i in range(0, len(items), _CACHE_BATCH):
+        yield items[i:i + _CACHE_BATCH]
+
+
+def open_cache(cache_dir):
+    """Open (and create, if needed) the parse cache database in
+    `cache_dir`.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    db = sqlite3.connect(os.path.join(cache_dir, 'cache.db'), timeout=60)
+    with db:
+        db.executescript(CACHE_SCHEMA)
+    return db
+
+
+def evict_cache(db, max_size):
+    """Delete the least recently used entries in the parse cache until
+    it holds at most `max_size` bytes. Call in a transaction.
+    """
+    (size,), = db.execute('SELECT size FROM total')
+    while size > max_size:
+        victims = db.execute(
+            'SELECT key, length(data) FROM pieces ORDER BY used LIMIT ?',
+            (_CACHE_BATCH,),
+        ).fetchall()
+        if not victims:
+            break
+        for key, length in victims:
+            db.execute('DELETE FROM pieces WHERE key = ?', (key,))
+            size -= length
+            if size <= max_size:
+                break
+    db.execute('UPDATE total SET size = ?', (max(size, 0),))
+
+
+def cached_parse(txt, include_pos=False, backend='rd', cache_dir=None,
+                 max_size=None):
+    """Parse a Bril program using the on-disk cache in `cache_dir` (by
+    default, `default_cache_dir()`), holding at most `max_size` bytes
+    (by default, `BRIL_PARSE_CACHE_SIZE`), and return its JSON data.
+
+    Each top-level struct or function is looked up by the hash of its
+    text and parsed only if it is missing from the cache. Cached source
+    positions are relative to the piece, so they are shifted to where
+    the piece appears in `txt`.
+    """
+    bounds = toplevel_bounds(txt)
+    if bounds is None:
+        return BACKENDS[backend](txt, include_pos)
+    if max_size is None:
+        max_size = int(os.environ.get('BRIL_PARSE_CACHE_SIZE',
+                                      DEFAULT_CACHE_SIZE))
+
+    pieces = list(split_toplevel(txt, bounds))
+    keys = [_cache_key(piece, include_pos) for _, piece in pieces]
+    db = open_cache(cache_dir or default_cache_dir())
+    try:
+        found = {}
+        for batch in _batches(set(keys)):
+            found.update(db.execute(
+                'SELECT key, data FROM pieces WHERE key IN ({})'.format(
+                    ','.join('?' * len(batch))),
+                batch,
+            ))
+
+        datas = []
+        added = {}
+        with gc_paused():
+            for (row, piece), key in zip(pieces, keys):
+                if key in found:
+                    data = pickle.loads(found[key])
+                else:
+                    try:
+                        data = BACKENDS[backend](piece, include_pos)
+                    except (ParseError, lark.exceptions.LarkError):
+                        datas.append(None)
+                        continue
+                    added[key] = pickle.dumps(data)
+                if include_pos and row:
+                    for func in data['functions']:
+                        shift_rows(func, row)
+                datas.append(data)
+
+        # Record what was used and added, evicting if it got too big.
+        now = time.time()
+        with db:
+            for batch in _batches(found):
+                db.execute(
+                    'UPDATE pieces SET used = ? WHERE key IN ({})'.format(
+                        ','.join('?' * len(batch))),
+                    [now] + batch,
+                )
+            grown = 0
+            for key, blob in added.items():
+                cur = db.execute(
+                    'INSERT OR IGNORE INTO pieces VALUES (?, ?, ?)',
+                    (key, blob, now),
+                )
+                if cur.rowcount:  # Not added by a concurrent parse.
+                    grown += len(blob)
+            if grown:
+                db.execute('UPDATE total SET size = size + ?', (grown,))
+                evict_cache(db, max_size)
+    finally:
+        db.close()
+
+    if None in datas:
+        # Parse everything for an error at the right position.
+        return BACKENDS[backend](txt, include_pos)
+    return merge_pieces(datas)
+
+
+def parse_bril(txt, include_pos=False, backend='rd', jobs=1, cache=False,
+               min_size=PARALLEL_MIN_SIZE):
     """Parse a Bril program and return a JSON string.
 
-    Optionally include source position information.
+    Optionally include source position information. The `backend` names
+    the parser implementation to use (see `BACKENDS`). With `jobs` other
+    than 1, programs of at least `min_size` characters are parsed in
+    parallel (see `parallel_parse`).
+    With `cache`, unchanged functions are reused from the on-disk parse
+    cache (see `cached_parse`); `cache` may also name the directory.
     """
-    parser = lark.Lark(GRAMMAR, maybe_placeholders=True)
-    tree = parser.parse(txt)
-    data = JSONTransformer(include_pos).transform(tree)
+    if cache:
+        data = cached_parse(txt, include_pos, backend,
+                            cache if isinstance(cache, str) else None)
+    elif jobs == 1:
+        data = BACKENDS[backend](txt, include_pos)
+    else:
+        data = parallel_parse(txt, include_pos, backend, jobs, min_size)
     return json.dumps(data, indent=2, sort_keys=True)
 
 
@@ -235,7 +866,7 @@ def type_to_str(type):
 
 def instr_to_string(instr):
     if instr['op'] == 'const':
-        tyann = ': {}'.format(type_to_str(instr['type'])) \
+        tyann = ': ' + type_to_str(instr['type']) \
             if 'type' in instr else ''
         return '{}{} = const {}'.format(
             instr['dest'],
@@ -245,17 +876,13 @@ def instr_to_string(instr):
     else:
         rhs = instr['op']
         if instr.get('funcs'):
-            rhs += ' {}'.format(' '.join(
-                '@{}'.format(f) for f in instr['funcs']
-            ))
+            rhs += ' @' + ' @'.join(instr['funcs'])
         if instr.get('args'):
-            rhs += ' {}'.format(' '.join(instr['args']))
+            rhs += ' ' + ' '.join(instr['args'])
         if instr.get('labels'):
-            rhs += ' {}'.format(' '.join(
-                '.{}'.format(f) for f in instr['labels']
-            ))
+            rhs += ' .' + ' .'.join(instr['labels'])
         if 'dest' in instr:
-            tyann = ': {}'.format(type_to_str(instr['type'])) \
+            tyann = ': ' + type_to_str(instr['type']) \
                 if 'type' in instr else ''
             return '{}{} = {}'.format(
                 instr['dest'],
@@ -284,31 +911,362 @@ def args_to_string(args):
         return ''
 
 
-def print_func(func):
+def func_to_string(func):
+    """Format a whole function as text, ending with a newline.
+    """
     typ = func.get('type', 'void')
-    print('@{}{}{} {{'.format(
+    lines = ['@{}{}{} {{'.format(
         func['name'],
         args_to_string(func.get('args', [])),
         ': {}'.format(type_to_str(typ)) if typ != 'void' else '',
-    ))
+    )]
     for instr_or_label in func['instrs']:
         if 'label' in instr_or_label:
-            print_label(instr_or_label)
+            lines.append('.' + instr_or_label['label'] + ':')
+        else:
+            lines.append('  ' + instr_to_string(instr_or_label) + ';')
+    lines.append('}\n')
+    return '\n'.join(lines)
+
+
+def print_func(func, out=None):
+    (out or sys.stdout).write(func_to_string(func))
+
+
+def print_funcs(funcs, out=None):
+    """Print a sequence of functions, one at a time, to a text file
+    (standard output by default).
+    """
+    out = out or sys.stdout
+    for func in funcs:
+        out.write(func_to_string(func))
+
+
+def print_prog(prog, out=None):
+    print_funcs(prog['functions'], out)
+
+
+class JSONStream:
+    """Read JSON values and punctuation from a text file a piece at a
+    time, so a large document never has to be in memory all at once.
+    """
+
+    _WS_RE = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size):
+        """Drop the consumed part of the buffer and read up to `size`
+        more characters. Return False at the end of the file.
+        """
+        data = self.fp.read(size)
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def char(self):
+        """Skip whitespace and return the next character without
+        consuming it, or the empty string at the end of the file.
+        """
+        while True:
+            self.pos = self._WS_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def expect(self, c):
+        """Consume the punctuation character `c`.
+        """
+        found = self.char()
+        if found != c:
+            raise ValueError('expected {!r} in JSON, found {!r}'.format(
+                c, found or 'end of file'
+            ))
+        self.pos += 1
+
+    def value(self):
+        """Consume and return a complete JSON value.
+        """
+        self.char()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # The value may just be incomplete. Grow the buffer
+                # geometrically to avoid quadratic re-decoding.
+                if self._fill(max(self.chunk_size, len(self.buf))):
+                    continue
+                raise
+            if end == len(self.buf) and self._fill(self.chunk_size):
+                continue  # A number may continue in the next chunk.
+            self.pos = end
+            return val
+
+
+def iter_functions(fp):
+    """Incrementally parse a Bril program in JSON from a text file and
+    generate its functions one at a time.
+
+    Other top-level fields (such as `structs`) are skipped.
+    """
+    stream = JSONStream(fp)
+    stream.expect('{')
+    if stream.char() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'functions':
+            stream.expect('[')
+            if stream.char() != ']':
+                while True:
+                    yield stream.value()
+                    if stream.char() == ']':
+                        break
+                    stream.expect(',')
+            stream.expect(']')
+        else:
+            stream.value()
+        if stream.char() == '}':
+            break
+        stream.expect(',')
+
+
+# Binary interchange format.
+#
+# A compact alternative to the JSON representation for passing programs
+# between tools. An encoded program consists of:
+#
+# - The magic bytes `BIN_MAGIC` (which include a format version).
+# - Two little-endian uint32s: the length of the header in bytes and the
+#   number of words in the body.
+# - The header: a UTF-8 JSON array `[strings, shapes, floats, bigints]`.
+#   `strings` is the table of every distinct string in the program
+#   (variable names, labels, opcodes, types, and object keys), each
+#   stored once. A shape is the list of keys of an object, as indices
+#   into `strings`. `floats` and `bigints` hold the float values and the
+#   integers that do not fit in a word.
+# - The body: a sequence of little-endian uint32 words encoding the
+#   program's JSON value. Each value is a tag word (see `BIN_TAGS`)
+#   followed by its payload: an index into a table, an integer's
+#   magnitude, or a length followed by the elements. An object is a
+#   shape index followed by its values, in the order of the shape's keys.
+#
+# Encoding any JSON value and decoding it again reproduces it exactly.
+
+BIN_MAGIC = b'\x89BRIL\x01'
+
+BIN_TAGS = (
+    'null',
+    'false',
+    'true',
+    'int',       # A non-negative integer under 2**32.
+    'negint',    # A negative integer above -2**32, stored negated.
+    'bigint',    # An index into `bigints`.
+    'float',     # An index into `floats`.
+    'str',       # An index into `strings`.
+    'strlist',   # A length N followed by N indices into `strings`.
+    'list',      # A length N followed by N values.
+    'obj',       # A shape index followed by one value per key.
+)
+(T_NULL, T_FALSE, T_TRUE, T_INT, T_NEGINT, T_BIGINT, T_FLOAT, T_STR,
+ T_STRLIST, T_LIST, T_OBJ) = range(len(BIN_TAGS))
+
+
+def is_bin(buf):
+    """Check whether a bytes buffer holds a program in the binary format.
+    """
+    return buf[:len(BIN_MAGIC)] == BIN_MAGIC
+
+
+def encode_bin(data):
+    """Encode Bril JSON data in the binary format and return the bytes.
+    """
+    strings = {}
+    shapes = {}
+    floats = []
+    bigints = []
+    words = []
+    emit = words.append
+
+    def intern(s):
+        try:
+            return strings[s]
+        except KeyError:
+            idx = strings[s] = len(strings)
+            return idx
+
+    def encode(val):
+        if isinstance(val, str):
+            emit(T_STR)
+            emit(intern(val))
+        elif isinstance(val, dict):
+            keys = tuple(val)
+            try:
+                shape = shapes[keys]
+            except KeyError:
+                shape = shapes[keys] = len(shapes)
+            emit(T_OBJ)
+            emit(shape)
+            for v in val.values():
+                encode(v)
+        elif isinstance(val, list):
+            if val and all(isinstance(v, str) for v in val):
+                emit(T_STRLIST)
+                emit(len(val))
+                for v in val:
+                    emit(intern(v))
+            else:
+                emit(T_LIST)
+                emit(len(val))
+                for v in val:
+                    encode(v)
+        elif val is True:
+            emit(T_TRUE)
+        elif val is False:
+            emit(T_FALSE)
+        elif val is None:
+            emit(T_NULL)
+        elif isinstance(val, int):
+            if 0 <= val < 1 << 32:
+                emit(T_INT)
+                emit(val)
+            elif -(1 << 32) < val < 0:
+                emit(T_NEGINT)
+                emit(-val)
+            else:
+                emit(T_BIGINT)
+                emit(len(bigints))
+                bigints.append(val)
+        elif isinstance(val, float):
+            emit(T_FLOAT)
+            emit(len(floats))
+            floats.append(val)
         else:
-            print_instr(instr_or_label)
-    print('}')
+            raise TypeError('cannot encode {!r}'.format(val))
+
+    encode(data)
+    shape_keys = [[intern(k) for k in keys] for keys in shapes]
+    header = json.dumps(
+        [list(strings), shape_keys, floats, bigints],
+        ensure_ascii=False, separators=(',', ':'),
+    ).encode('utf8')
+    body = array.array('I', words)
+    if sys.byteorder != 'little':
+        body.byteswap()
+    return BIN_MAGIC + struct.pack('<II', len(header), len(body)) + \
+        header + body.tobytes()
 
 
-def print_prog(prog):
-    for func in prog['functions']:
-        print_func(func)
+def decode_bin(buf):
+    """Decode a program in the binary format and return its JSON data.
+    """
+    if not is_bin(buf):
+        raise ValueError('not a binary Bril program')
+    off = len(BIN_MAGIC)
+    header_len, body_len = struct.unpack_from('<II', buf, off)
+    off += 8
+    strings, shape_keys, floats, bigints = \
+        json.loads(buf[off:off + header_len].decode('utf8'))
+    shapes = [tuple(strings[k] for k in keys) for keys in shape_keys]
+    off += header_len
+    body = array.array('I')
+    body.frombytes(buf[off:off + 4 * body_len])
+    if sys.byteorder != 'little':
+        body.byteswap()
+    words = body.tolist()
+    idx = 0
+
+    def decode():
+        nonlocal idx
+        tag = words[idx]
+        if tag == T_STR:
+            idx += 2
+            return strings[words[idx - 1]]
+        elif tag == T_OBJ:
+            keys = shapes[words[idx + 1]]
+            idx += 2
+            out = {}
+            for key in keys:
+                # Inline the common string-valued fields.
+                tag = words[idx]
+                if tag == T_STR:
+                    out[key] = strings[words[idx + 1]]
+                    idx += 2
+                elif tag == T_STRLIST:
+                    n = words[idx + 1]
+                    idx += 2 + n
+                    out[key] = [strings[i] for i in words[idx - n:idx]]
+                else:
+                    out[key] = decode()
+            return out
+        elif tag == T_STRLIST:
+            n = words[idx + 1]
+            idx += 2 + n
+            return [strings[i] for i in words[idx - n:idx]]
+        elif tag == T_LIST:
+            n = words[idx + 1]
+            idx += 2
+            return [decode() for _ in range(n)]
+        elif tag == T_INT:
+            idx += 2
+            return words[idx - 1]
+        elif tag == T_NEGINT:
+            idx += 2
+            return -words[idx - 1]
+        elif tag == T_TRUE:
+            idx += 1
+            return True
+        elif tag == T_FALSE:
+            idx += 1
+            return False
+        elif tag == T_NULL:
+            idx += 1
+            return None
+        elif tag == T_FLOAT:
+            idx += 2
+            return floats[words[idx - 1]]
+        elif tag == T_BIGINT:
+            idx += 2
+            return bigints[words[idx - 1]]
+        else:
+            raise ValueError('bad tag {} in binary Bril program'.format(tag))
+
+    with gc_paused():
+        return decode()
 
 
 # Command-line entry points.
 
 def bril2json():
-    print(parse_bril(sys.stdin.read(), '-p' in sys.argv[1:]))
+    jobs = os.environ.get('BRIL_PARSE_JOBS')
+    print(parse_bril(
+        sys.stdin.read(),
+        '-p' in sys.argv[1:],
+        'lark' if '--lark' in sys.argv[1:] else 'rd',
+        jobs=int(jobs) if jobs else None,
+        cache='--cache' in sys.argv[1:],
+        min_size=int(os.environ.get('BRIL_PARSE_MIN_SIZE',
+                                    PARALLEL_MIN_SIZE)),
+    ))
 
 
 def bril2txt():
-    print_prog(json.load(sys.stdin))
+    print_funcs(iter_functions(sys.stdin))
+
+
+def bril2bin():
+    sys.stdout.buffer.write(encode_bin(json.load(sys.stdin)))
+
+
+def bin2bril():
+    data = decode_bin(sys.stdin.buffer.read())
+    print(json.dumps(data, indent=2, sort_keys=True))
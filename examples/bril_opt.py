@@ -0,0 +1,116 @@
+"""Run a sequence of the example passes on a Bril program in a single
+process.
+
+Each command-line argument is one pass, with its own arguments separated
+by spaces, like this:
+
+    bril2json < prog.bril | python3 bril_opt.py "lvn -p -c -f" "tdce tdce+"
+
+The program is read once, the passes run in order on the in-memory
+program, and the result is written once at the end (in the same format,
+JSON or binary, as the input). A pipeline may end with an analysis,
+which prints its results instead of the program. The wall-clock time
+for each pass goes to standard error.
+"""
+
+import sys
+import time
+
+from util import read_bril, write_bril
+import lvn
+import tdce
+import to_ssa
+import from_ssa
+import df
+
+
+def run_lvn(bril, args):
+    lvn.lvn(bril, '-p' in args, '-c' in args, '-f' in args)
+
+
+def run_tdce(bril, args):
+    modify_func = tdce.MODES[args[0]] if args else tdce.trivial_dce
+    for func in bril['functions']:
+        modify_func(func)
+
+
+def run_to_ssa(bril, args):
+    to_ssa.to_ssa(bril)
+
+
+def run_from_ssa(bril, args):
+    from_ssa.from_ssa(bril)
+
+
+def run_df(bril, args):
+    df.run_df(bril, df.ANALYSES[args[0]])
+
+
+# Passes that transform the program in place.
+PASSES = {
+    'lvn': run_lvn,
+    'tdce': run_tdce,
+    'to_ssa': run_to_ssa,
+    'from_ssa': run_from_ssa,
+}
+
+# Passes that print a report about the program. These can only come last
+# in a pipeline.
+ANALYSES = {
+    'df': run_df,
+}
+
+
+def parse_pipeline(specs):
+    """Turn a list of pass specifications (strings like `"tdce tdce+"`)
+    into a list of `(name, args)` pairs.
+    """
+    pipeline = []
+    for i, spec in enumerate(specs):
+        name, *args = spec.split()
+        if name in ANALYSES:
+            if i != len(specs) - 1:
+                raise ValueError('analysis {} must be the last pass'
+                                 .format(name))
+            if name == 'df' and (len(args) != 1 or
+                                 args[0] not in df.ANALYSES):
+                raise ValueError('usage: df {}'.format(
+                    '|'.join(df.ANALYSES)))
+        elif name not in PASSES:
+            raise ValueError('unknown pass {}'.format(name))
+        elif name == 'tdce' and (len(args) > 1 or
+                                 args and args[0] not in tdce.MODES):
+            raise ValueError('usage: tdce [{}]'.format(
+                '|'.join(tdce.MODES)))
+        pipeline.append((name, args))
+    return pipeline
+
+
+def log_time(label, start):
+    print('{}: {:.1f} ms'.format(label, (time.perf_counter() - start) * 1000),
+          file=sys.stderr)
+
+
+def bril_opt(specs):
+    pipeline = parse_pipeline(specs)
+
+    start = time.perf_counter()
+    bril, binary = read_bril()
+    log_time('(read)', start)
+
+    for name, args in pipeline:
+        start = time.perf_counter()
+        if name in ANALYSES:
+            ANALYSES[name](bril, args)
+            log_time(' '.join([name] + args), start)
+            return
+        PASSES[name](bril, args)
+        log_time(' '.join([name] + args), start)
+
+    start = time.perf_counter()
+    write_bril(bril, binary)
+    log_time('(write)', start)
+
+
+if __name__ == '__main__':
+    bril_opt(sys.argv[1:])
@@ -1,4 +1,6 @@
-from collections import OrderedDict
+from array import array
+from collections import Counter, OrderedDict
+from itertools import accumulate, chain, repeat
 from util import fresh, flatten
 from form_blocks import TERMINATORS
 
@@ -13,6 +15,7 @@ def block_map(blocks):
     labels removed.
     """
     by_name = OrderedDict()
+    anon = 1  # Names below b<anon> are already taken.
 
     for block in blocks:
         # Generate a name for the block.
@@ -22,8 +25,12 @@ def block_map(blocks):
             name = block[0]['label']
             block = block[1:]
         else:
-            # Make up a new name for this anonymous block.
-            name = fresh('b', by_name)
+            # Make up a new name for this anonymous block. Names are
+            # only ever added, so the search can resume where the last
+            # one stopped.
+            while 'b' + str(anon) in by_name:
+                anon += 1
+            name = 'b' + str(anon)
 
         # Add the block to the mapping.
         by_name[name] = block
@@ -49,20 +56,21 @@ def add_terminators(blocks):
     """Given an ordered block map, modify the blocks to add terminators
     to all blocks (avoiding "fall-through" control flow transfers).
     """
+    names = list(blocks.keys())
     for i, block in enumerate(blocks.values()):
         if not block:
             if i == len(blocks) - 1:
                 # In the last block, return.
                 block.append({'op': 'ret', 'args': []})
             else:
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({'op': 'jmp', 'labels': [dest]})
         elif block[-1]['op'] not in TERMINATORS:
             if i == len(blocks) - 1:
                 block.append({'op': 'ret', 'args': []})
             else:
                 # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({'op': 'jmp', 'labels': [dest]})
 
 
@@ -102,6 +110,136 @@ def edges(blocks):
     return preds, succs
 
 
+class CFG:
+    """A compact, integer-indexed control-flow graph.
+
+    Blocks are numbered 0 through n-1 in the order they are given, so
+    block 0 is the entry. The edges are stored in compressed sparse row
+    form: the successors of block `i` are
+    `succ_list[succ_start[i]:succ_start[i + 1]]`, in the same order as
+    the labels in its terminator (and likewise for predecessors, in
+    block order). The postorder and reverse postorder of the blocks
+    reachable from the entry are computed on first use and cached.
+    """
+
+    def __init__(self, names, succ):
+        """Build a graph from a list of block names and a parallel list
+        of successor lists, given as names.
+        """
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+
+        # Successors, in order.
+        succ = list(succ)
+        lengths = list(map(len, succ))
+        succ_list = list(map(self.index.__getitem__,
+                             chain.from_iterable(succ)))
+        self.succ_start = array('i', [0])
+        self.succ_start.extend(accumulate(lengths))
+        self.succ_list = array('i', succ_list)
+
+        # Predecessors: a stable sort of the edges by target keeps each
+        # block's predecessors in block order.
+        sources = list(chain.from_iterable(map(repeat, range(n), lengths)))
+        order = sorted(range(len(succ_list)), key=succ_list.__getitem__)
+        self.pred_list = array('i', map(sources.__getitem__, order))
+        counts = Counter(succ_list)
+        self.pred_start = array('i', [0])
+        self.pred_start.extend(accumulate(map(counts.__getitem__, range(n))))
+
+        self._postorder = None
+        self._rpo_number = None
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """Build the graph for a block map whose blocks all end in
+        terminators (see `add_terminators`).
+        """
+        return cls(blocks.keys(),
+                   [successors(block[-1]) for block in blocks.values()])
+
+    @classmethod
+    def from_succ(cls, succ, entry):
+        """Build the graph for a successor edge map, mapping block names
+        to lists of block names, with `entry` as block 0.
+        """
+        names = [entry] + [name for name in succ if name != entry]
+        return cls(names, [succ[name] for name in names])
+
+    def __len__(self):
+        return len(self.names)
+
+    def succs(self, i):
+        return self.succ_list[self.succ_start[i]:self.succ_start[i + 1]]
+
+    def preds(self, i):
+        return self.pred_list[self.pred_start[i]:self.pred_start[i + 1]]
+
+    def succ_map(self):
+        """Get the successor edges as a map from names to name lists.
+        """
+        names = self.names
+        return {name: [names[s] for s in self.succs(i)]
+                for i, name in enumerate(names)}
+
+    def pred_map(self):
+        """Get the predecessor edges as a map from names to name lists.
+        """
+        names = self.names
+        return {name: [names[p] for p in self.preds(i)]
+                for i, name in enumerate(names)}
+
+    @property
+    def postorder(self):
+        """The blocks reachable from the entry, in depth-first
+        postorder (visiting successors in terminator order).
+        """
+        if self._postorder is None:
+            out = array('i')
+            if self.names:
+                succ_start, succ_list = self.succ_start, self.succ_list
+                seen = bytearray(len(self.names))
+                seen[0] = 1
+                # The position of the next successor edge to follow out
+                # of each block on the stack.
+                next_edge = list(succ_start)
+                stack = [0]
+                while stack:
+                    node = stack[-1]
+                    k, end = next_edge[node], succ_start[node + 1]
+                    while k < end and seen[succ_list[k]]:
+                        k += 1
+                    if k < end:
+                        next_edge[node] = k + 1
+                        s = succ_list[k]
+                        seen[s] = 1
+                        stack.append(s)
+                    else:
+                        stack.pop()
+                        out.append(node)
+            self._postorder = out
+        return self._postorder
+
+    @property
+    def rpo(self):
+        """The blocks reachable from the entry, in reverse postorder.
+        """
+        return self.postorder[::-1]
+
+    @property
+    def rpo_number(self):
+        """Each block's position in the reverse postorder, or -1 for
+        unreachable blocks.
+        """
+        if self._rpo_number is None:
+            number = array('i', [-1]) * len(self.names)
+            for i, node in enumerate(reversed(self.postorder)):
+                number[node] = i
+            self._rpo_number = number
+        return self._rpo_number
+
+
 def reassemble(blocks):
     """Flatten a CFG into an instruction list."""
     # This could optimize slightly by opportunistically eliminating
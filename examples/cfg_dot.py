@@ -3,9 +3,9 @@ emit a GraphViz file.
 """
 
 from form_blocks import form_blocks
-import json
 import sys
 from cfg import block_map, successors, add_terminators
+from util import read_bril
 
 
 def cfg_dot(bril, verbose):
@@ -44,4 +44,4 @@ def cfg_dot(bril, verbose):
 
 
 if __name__ == '__main__':
-    cfg_dot(json.load(sys.stdin), '-v' in sys.argv[1:])
+    cfg_dot(read_bril()[0], '-v' in sys.argv[1:])
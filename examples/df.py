@@ -1,9 +1,9 @@
 import sys
-import json
-from collections import namedtuple
+from collections import deque, namedtuple
 
 from form_blocks import form_blocks
 import cfg
+from util import read_bril
 
 # A single dataflow analysis consists of these part:
 # - forward: True for forward, False for backward.
@@ -24,36 +24,41 @@ def df_worklist(blocks, analysis):
     """The worklist algorithm for iterating a data flow analysis to a
     fixed point.
     """
-    preds, succs = cfg.edges(blocks)
+    graph = cfg.CFG.from_blocks(blocks)
+    values = list(blocks.values())
+    n = len(graph)
 
     # Switch between directions.
     if analysis.forward:
-        first_block = list(blocks.keys())[0]  # Entry.
-        in_edges = preds
-        out_edges = succs
+        first_block = 0  # Entry.
+        in_edges = graph.preds
+        out_edges = graph.succs
     else:
-        first_block = list(blocks.keys())[-1]  # Exit.
-        in_edges = succs
-        out_edges = preds
+        first_block = n - 1  # Exit.
+        in_edges = graph.succs
+        out_edges = graph.preds
 
     # Initialize.
-    in_ = {first_block: analysis.init}
-    out = {node: analysis.init for node in blocks}
+    in_ = [None] * n
+    in_[first_block] = analysis.init
+    out = [analysis.init] * n
 
     # Iterate.
-    worklist = list(blocks.keys())
+    worklist = deque(range(n))
     while worklist:
-        node = worklist.pop(0)
+        node = worklist.popleft()
 
-        inval = analysis.merge(out[n] for n in in_edges[node])
+        inval = analysis.merge(out[p] for p in in_edges(node))
         in_[node] = inval
 
-        outval = analysis.transfer(blocks[node], inval)
+        outval = analysis.transfer(values[node], inval)
 
         if outval != out[node]:
             out[node] = outval
-            worklist += out_edges[node]
+            worklist.extend(out_edges(node))
 
+    in_ = dict(zip(graph.names, in_))
+    out = dict(zip(graph.names, out))
     if analysis.forward:
         return in_, out
     else:
@@ -165,5 +170,5 @@ ANALYSES = {
 }
 
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
+    bril, _ = read_bril()
     run_df(bril, ANALYSES[sys.argv[1]])
@@ -1,8 +1,10 @@
 import json
 import sys
+from array import array
 
-from cfg import block_map, successors, add_terminators, add_entry
+from cfg import block_map, add_terminators, add_entry, CFG
 from form_blocks import form_blocks
+from util import read_bril
 
 
 def map_inv(succ):
@@ -21,14 +23,25 @@ def map_inv(succ):
 def postorder_helper(succ, root, explored, out):
     """Given a successor edge map, produce a list of all the nodes in
     the graph in postorder by appending to the `out` list.
+
+    The search uses an explicit stack of successor iterators, so it
+    handles arbitrarily deep graphs.
     """
     if root in explored:
         return
     explored.add(root)
 
-    for s in succ[root]:
-        postorder_helper(succ, s, explored, out)
-    out.append(root)
+    stack = [(root, iter(succ[root]))]
+    while stack:
+        node, it = stack[-1]
+        for s in it:
+            if s not in explored:
+                explored.add(s)
+                stack.append((s, iter(succ[s])))
+                break
+        else:
+            stack.pop()
+            out.append(node)
 
 
 def postorder(succ, root):
@@ -37,71 +50,213 @@ def postorder(succ, root):
     return out
 
 
-def intersect(sets):
-    sets = list(sets)
-    if not sets:
-        return set()
-    out = set(sets[0])
-    for s in sets[1:]:
-        out &= s
-    return out
-
-
-def get_dom(succ, entry):
-    pred = map_inv(succ)
-    nodes = list(reversed(postorder(succ, entry)))  # Reverse postorder.
-
-    dom = {v: set(nodes) for v in succ}
+def idoms(graph):
+    """Find the immediate dominator of every block in a `cfg.CFG`,
+    using the iterative algorithm of Cooper, Harvey, and Kennedy ("A
+    Simple, Fast Dominance Algorithm") over reverse postorder numbers.
 
-    while True:
+    Produce an array mapping each block number to the number of its
+    immediate dominator. The entry is its own immediate dominator, and
+    unreachable blocks get -1.
+    """
+    number = graph.rpo_number
+    rpo = graph.rpo
+    idom = array('i', [-1]) * len(graph)
+    if not rpo:
+        return idom
+    idom[rpo[0]] = rpo[0]
+
+    changed = True
+    while changed:
         changed = False
-
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
-
-            if dom[node] != new_dom:
-                dom[node] = new_dom
+        for node in rpo[1:]:
+            # Intersect the dominator chains of all the processed
+            # predecessors by walking the deeper "finger" up the tree.
+            new_idom = -1
+            for p in graph.preds(node):
+                if idom[p] == -1:
+                    continue
+                if new_idom == -1:
+                    new_idom = p
+                    continue
+                a, b = p, new_idom
+                while a != b:
+                    while number[a] > number[b]:
+                        a = idom[a]
+                    while number[b] > number[a]:
+                        b = idom[b]
+                new_idom = a
+
+            if idom[node] != new_idom:
+                idom[node] = new_idom
                 changed = True
 
-        if not changed:
-            break
+    return idom
 
-    return dom
 
+def dom_sets(graph, idom):
+    """Expand immediate dominators into the full dominance relation: a
+    map from each block name to the set of names of the blocks that
+    dominate it.
 
-def dom_fronts(dom, succ):
-    """Compute the dominance frontier, given the dominance relation.
+    Every reachable block dominates an unreachable one.
     """
-    dom_inv = map_inv(dom)
+    names = graph.names
+    rpo = graph.rpo
+    dom = {}
+    for node in rpo:
+        parent = idom[node]
+        if parent == node:
+            dom[names[node]] = {names[node]}
+        else:
+            dom[names[node]] = dom[names[parent]] | {names[node]}
+    reachable = {names[node] for node in rpo}
+    return {name: dom[name] if name in dom else set(reachable)
+            for name in names}
 
-    frontiers = {}
-    for block in dom:
-        # Find all successors of dominated blocks.
-        dominated_succs = set()
-        for dominated in dom_inv[block]:
-            dominated_succs.update(succ[dominated])
 
-        # You're in the frontier if you're not strictly dominated by the
-        # current block.
-        frontiers[block] = [b for b in dominated_succs
-                            if b not in dom_inv[block] or b == block]
+def get_dom(succ, entry):
+    """Compute the dominance relation for a successor edge map.
+    """
+    graph = CFG.from_succ(succ, entry)
+    return dom_sets(graph, idoms(graph))
 
-    return frontiers
 
+def dom_fronts(graph, idom):
+    """Compute the dominance frontier of every block, given the
+    immediate dominators.
 
-def dom_tree(dom):
-    # Get the blocks strictly dominated by a block strictly dominated by
-    # a given block.
-    dom_inv = map_inv(dom)
-    dom_inv_strict = {a: {b for b in bs if b != a}
-                      for a, bs in dom_inv.items()}
-    dom_inv_strict_2x = {a: set().union(*(dom_inv_strict[b] for b in bs))
-                         for a, bs in dom_inv_strict.items()}
-    return {
-        a: {b for b in bs if b not in dom_inv_strict_2x[a]}
-        for a, bs in dom_inv_strict.items()
-    }
+    Following Cytron et al., a join point is in the frontier of each
+    block on the dominator tree path from each of its predecessors up
+    to (but not including) its own immediate dominator.
+    """
+    names = graph.names
+    frontiers = [set() for _ in names]
+    for node in graph.rpo:
+        for p in graph.preds(node):
+            if idom[p] == -1:
+                continue  # Unreachable predecessor.
+            runner = p
+            while runner != idom[node]:
+                frontiers[runner].add(node)
+                if runner == idom[runner]:
+                    break
+                runner = idom[runner]
+    return {names[v]: [names[b] for b in bs]
+            for v, bs in enumerate(frontiers)}
+
+
+def dom_tree(graph, idom):
+    """Get the dominator tree as a map from each block name to the set
+    of names of its children.
+    """
+    names = graph.names
+    tree = {name: set() for name in names}
+    for node in graph.rpo:
+        if idom[node] != node:
+            tree[names[idom[node]]].add(names[node])
+    return tree
+
+
+class DomTree:
+    """Constant-time dominance queries for a `cfg.CFG`.
+
+    The dominator tree is numbered in depth-first preorder and
+    postorder, so that `a` dominates `b` exactly when `b`'s interval
+    nests inside `a`'s. Nearest common dominators climb the tree along
+    skew-binary jump pointers (Myers, "An applicative random-access
+    stack"), which takes O(log n) steps. Everything is stored in a few
+    arrays with one entry per block.
+
+    Queries take block names. Unreachable blocks neither dominate nor
+    are dominated by any block, including themselves.
+    """
+
+    def __init__(self, graph, idom=None):
+        self.graph = graph
+        self.idom = idoms(graph) if idom is None else idom
+        n = len(graph)
+
+        self.children = [[] for _ in range(n)]
+        rpo = graph.rpo
+        for node in rpo:
+            if self.idom[node] != node:
+                self.children[self.idom[node]].append(node)
+
+        # Number the tree with an explicit stack; each frame is a node
+        # and the position of its next child.
+        self.pre = array('i', [-1]) * n
+        self.post = array('i', [-1]) * n
+        self.depth = array('i', [0]) * n
+        self.jump = array('i', [-1]) * n
+        self.preorder = array('i')
+        if rpo:
+            root = rpo[0]
+            self.jump[root] = root
+            stack = [[root, 0]]
+            self._visit(root)
+            clock = 0
+            while stack:
+                frame = stack[-1]
+                node, k = frame
+                kids = self.children[node]
+                if k < len(kids):
+                    frame[1] = k + 1
+                    self._visit(kids[k])
+                    stack.append([kids[k], 0])
+                else:
+                    stack.pop()
+                    self.post[node] = clock
+                    clock += 1
+
+    def _visit(self, node):
+        """Give a node its preorder number, depth, and jump pointer.
+        Its parent must already have been visited.
+        """
+        self.pre[node] = len(self.preorder)
+        self.preorder.append(node)
+        parent = self.idom[node]
+        if parent == node:
+            return
+        depth, jump = self.depth, self.jump
+        depth[node] = depth[parent] + 1
+        up = jump[parent]
+        if depth[parent] - depth[up] == depth[up] - depth[jump[up]]:
+            jump[node] = jump[up]
+        else:
+            jump[node] = parent
+
+    def _dominates(self, a, b):
+        return (self.pre[a] <= self.pre[b] and
+                self.post[b] <= self.post[a] and
+                self.pre[a] != -1 and self.pre[b] != -1)
+
+    def dominates(self, a, b):
+        """Check whether block `a` dominates block `b`.
+        """
+        index = self.graph.index
+        return self._dominates(index[a], index[b])
+
+    def strictly_dominates(self, a, b):
+        """Check whether block `a` dominates block `b` and is not `b`.
+        """
+        return a != b and self.dominates(a, b)
+
+    def nearest_common_dominator(self, a, b):
+        """Find the deepest block that dominates both `a` and `b`, or
+        None if either is unreachable.
+        """
+        index = self.graph.index
+        a, b = index[a], index[b]
+        if self.pre[a] == -1 or self.pre[b] == -1:
+            return None
+
+        # Climb from `a` to the deepest ancestor that dominates `b`,
+        # taking the long jump whenever it does not overshoot.
+        while not self._dominates(a, b):
+            up = self.jump[a]
+            a = self.idom[a] if self._dominates(up, b) else up
+        return self.graph.names[a]
 
 
 def print_dom(bril, mode):
@@ -109,25 +264,30 @@ def print_dom(bril, mode):
         blocks = block_map(form_blocks(func['instrs']))
         add_entry(blocks)
         add_terminators(blocks)
-        succ = {name: successors(block[-1]) for name, block in blocks.items()}
-        dom = get_dom(succ, list(blocks.keys())[0])
-
-        if mode == 'front':
-            res = dom_fronts(dom, succ)
-        elif mode == 'tree':
-            res = dom_tree(dom)
+        graph = CFG.from_blocks(blocks)
+        idom = idoms(graph)
+
+        if mode == 'ncd':
+            # Query the nearest common dominator of every pair of blocks.
+            tree = DomTree(graph, idom)
+            res = {a: {b: tree.nearest_common_dominator(a, b)
+                       for b in blocks}
+                   for a in blocks}
         else:
-            res = dom
+            if mode == 'front':
+                res = dom_fronts(graph, idom)
+            elif mode == 'tree':
+                res = dom_tree(graph, idom)
+            else:
+                res = dom_sets(graph, idom)
+            res = {k: sorted(list(v)) for k, v in res.items()}
 
         # Format as JSON for stable output.
-        print(json.dumps(
-            {k: sorted(list(v)) for k, v in res.items()},
-            indent=2, sort_keys=True,
-        ))
+        print(json.dumps(res, indent=2, sort_keys=True))
 
 
 if __name__ == '__main__':
     print_dom(
-        json.load(sys.stdin),
+        read_bril()[0],
         'dom' if len(sys.argv) < 2 else sys.argv[1]
     )
@@ -1,8 +1,7 @@
 """Create and print out the basic blocks in a Bril function.
 """
 
-import json
-import sys
+from util import read_bril
 
 # Instructions that terminate a basic block.
 TERMINATORS = 'br', 'jmp', 'ret'
@@ -68,4 +67,4 @@ def print_blocks(bril):
 
 
 if __name__ == '__main__':
-    print_blocks(json.load(sys.stdin))
+    print_blocks(read_bril()[0])
@@ -1,8 +1,6 @@
-import json
-import sys
-
 from cfg import block_map, add_terminators, add_entry, reassemble
 from form_blocks import form_blocks
+from passcache import run_pass
 
 
 def func_from_ssa(func):
@@ -44,4 +42,4 @@ def from_ssa(bril):
 
 
 if __name__ == '__main__':
-    print(json.dumps(from_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    run_pass('from_ssa', [], from_ssa)
@@ -1,5 +1,4 @@
-import json
-import sys
+from util import read_bril
 
 
 def is_ssa(bril):
@@ -19,4 +18,4 @@ def is_ssa(bril):
 
 
 if __name__ == '__main__':
-    print('yes' if is_ssa(json.load(sys.stdin)) else 'no')
+    print('yes' if is_ssa(read_bril()[0]) else 'no')
@@ -1,11 +1,11 @@
 """Local value numbering for Bril.
 """
-import json
 import sys
 from collections import namedtuple
 
 from form_blocks import form_blocks
 from util import flatten
+from passcache import run_pass
 
 # A Value uniquely represents a computation in terms of sub-values.
 Value = namedtuple('Value', ['op', 'args'])
@@ -263,6 +263,6 @@ def lvn(bril, prop=False, canon=False, fold=False):
 
 
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
-    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv)
-    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+    run_pass('lvn', sys.argv[1:], lambda bril: lvn(
+        bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv,
+    ))
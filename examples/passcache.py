@@ -0,0 +1,174 @@
+"""A persistent cache for the outputs of optimization passes.
+
+Set the `BRIL_PASS_CACHE` environment variable to a directory to enable
+the cache for the example passes (`lvn.py`, `tdce.py`, `to_ssa.py`, and
+`from_ssa.py`). Each output is keyed by a hash of the canonical input
+program, the pass name and flags, the output format, and the source code
+of the pass (all the example modules it has loaded), so editing a pass
+invalidates its entries. When the cache grows beyond
+`BRIL_PASS_CACHE_SIZE` bytes (default: 512 MiB), the least recently used
+outputs are evicted. Each run reports whether it hit and the cumulative
+statistics on standard error.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from util import load_bril, dump_bril
+
+DEFAULT_SIZE = 512 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    key TEXT PRIMARY KEY,
+    output BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_used ON outputs (used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+
+
+def source_hash():
+    """Hash the source code of every loaded module from this directory,
+    including the main script.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = set()
+    for mod in list(sys.modules.values()):
+        path = getattr(mod, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == here:
+            paths.add(os.path.abspath(path))
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        h.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def cache_key(bril, name, args, binary):
+    """Compute the cache key for running a pass on a program.
+    """
+    canonical = json.dumps(bril, sort_keys=True, separators=(',', ':'))
+    h = hashlib.sha256()
+    for part in (name, ' '.join(args), str(binary), source_hash()):
+        h.update(part.encode())
+        h.update(b'\0')
+    h.update(canonical.encode())
+    return h.hexdigest()
+
+
+class PassCache:
+    """An LRU cache of pass outputs, stored in an SQLite database in
+    `path` and limited to `max_size` bytes of outputs.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, 'passes.db'),
+                                  timeout=60)
+        self.db.executescript(SCHEMA)
+        self.max_size = max_size
+
+    def get(self, key):
+        """Look up an output, marking it as recently used. Return None on
+        a miss.
+        """
+        with self.db:
+            row = self.db.execute(
+                'SELECT output FROM outputs WHERE key = ?', (key,)
+            ).fetchone()
+            if row:
+                self.db.execute('UPDATE outputs SET used = ? WHERE key = ?',
+                                (time.time(), key))
+            self._count('hits' if row else 'misses')
+        return row[0] if row else None
+
+    def put(self, key, output):
+        """Store an output and evict old outputs beyond the size limit.
+        """
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+                (key, output, len(output), time.time()),
+            )
+            total, = self.db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM outputs'
+            ).fetchone()
+            if total > self.max_size:
+                self._evict(total - self.max_size)
+
+    def _evict(self, excess):
+        evicted = []
+        for key, size in self.db.execute(
+            'SELECT key, size FROM outputs ORDER BY used'
+        ):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        self.db.executemany('DELETE FROM outputs WHERE key = ?', evicted)
+        self._count('evictions', len(evicted))
+
+    def _count(self, name, n=1):
+        self.db.execute(
+            'INSERT INTO stats VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET count = count + ?',
+            (name, n, n),
+        )
+
+    def stats(self):
+        return dict(self.db.execute('SELECT name, count FROM stats'))
+
+
+def open_cache():
+    """Open the cache configured by the environment, or return None if
+    it is disabled.
+    """
+    path = os.environ.get('BRIL_PASS_CACHE')
+    if not path:
+        return None
+    size = int(os.environ.get('BRIL_PASS_CACHE_SIZE', DEFAULT_SIZE))
+    return PassCache(path, size)
+
+
+def run_pass(name, args, transform):
+    """Read a program from standard input, apply `transform` to it, and
+    write the result to standard output, using the cache if enabled.
+
+    `transform` modifies the program in place. `name` and `args` identify
+    the pass and its flags in the cache key.
+    """
+    bril, binary = load_bril(sys.stdin.buffer.read())
+    cache = open_cache()
+    if cache is None:
+        transform(bril)
+        sys.stdout.buffer.write(dump_bril(bril, binary))
+        return
+
+    key = cache_key(bril, name, args, binary)
+    output = cache.get(key)
+    hit = output is not None
+    if not hit:
+        transform(bril)
+        output = dump_bril(bril, binary)
+        cache.put(key, output)
+    sys.stdout.buffer.write(output)
+
+    stats = cache.stats()
+    print('pass cache: {} {} ({} hits, {} misses, {} evictions)'.format(
+        'hit' if hit else 'miss',
+        ' '.join([name] + args),
+        stats.get('hits', 0),
+        stats.get('misses', 0),
+        stats.get('evictions', 0),
+    ), file=sys.stderr)
@@ -3,9 +3,9 @@ local optimization.
 """
 
 import sys
-import json
 from form_blocks import form_blocks
 from util import flatten
+from passcache import run_pass
 
 
 def trivial_dce_pass(func):
@@ -127,10 +127,10 @@ def localopt():
         modify_func = trivial_dce
 
     # Apply the change to all the functions in the input program.
-    bril = json.load(sys.stdin)
-    for func in bril['functions']:
-        modify_func(func)
-    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+    def transform(bril):
+        for func in bril['functions']:
+            modify_func(func)
+    run_pass('tdce', sys.argv[1:], transform)
 
 
 if __name__ == '__main__':
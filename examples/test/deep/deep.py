@@ -0,0 +1,62 @@
+"""Generate huge Bril functions for stress-testing the graph traversals.
+
+    python3 deep.py straight N  # N blocks in a chain.
+    python3 deep.py nested N    # Conditionals nested N deep (2N blocks).
+
+Both programs count the blocks they run through in `x` and print it. Each
+test file is the program this generates with N = 3, and its `ARGS:` give
+the full-size version. The tests convert both sizes to SSA, snapshotting
+all of the small result and the last few lines of the big one, which
+checks that the conversion finishes (deeper than Python's default
+recursion limit) and numbers every definition of `x`. See `traverse.py`
+for the tests of the graph traversals themselves.
+"""
+
+import json
+import sys
+
+
+def incr(instrs):
+    instrs.append({'op': 'add', 'type': 'int', 'dest': 'x',
+                   'args': ['x', 'one']})
+
+
+def straight(n):
+    instrs = []
+    for i in range(n):
+        instrs.append({'label': 'l{}'.format(i)})
+        incr(instrs)
+        instrs.append({'op': 'jmp', 'labels': ['l{}'.format(i + 1)]})
+    instrs.append({'label': 'l{}'.format(n)})
+    return instrs
+
+
+def nested(n):
+    # Each level branches either one level deeper or straight to its
+    # join point, so every join merges two definitions of `x`.
+    instrs = []
+    for i in range(n):
+        instrs.append({'label': 'in{}'.format(i)})
+        incr(instrs)
+        instrs.append({'op': 'br', 'args': ['c'],
+                       'labels': ['in{}'.format(i + 1), 'out{}'.format(i)]})
+    instrs.append({'label': 'in{}'.format(n)})
+    instrs.append({'op': 'jmp', 'labels': ['out{}'.format(n - 1)]})
+    for i in reversed(range(n)):
+        instrs.append({'label': 'out{}'.format(i)})
+        incr(instrs)
+    return instrs
+
+
+def program(shape, n):
+    body = {'straight': straight, 'nested': nested}[shape](n)
+    instrs = [
+        {'op': 'const', 'type': 'int', 'dest': 'x', 'value': 0},
+        {'op': 'const', 'type': 'int', 'dest': 'one', 'value': 1},
+        {'op': 'const', 'type': 'bool', 'dest': 'c', 'value': True},
+    ] + body + [{'op': 'print', 'args': ['x']}]
+    return {'functions': [{'name': 'main', 'instrs': instrs}]}
+
+
+if __name__ == '__main__':
+    json.dump(program(sys.argv[1], int(sys.argv[2])), sys.stdout)
@@ -0,0 +1,137 @@
+"""Check the iterative graph traversals against the recursive versions
+they replaced, and run them on a huge graph.
+
+    bril2json < prog.bril | python3 traverse.py SHAPE N
+
+The traversals are `dom.postorder` and `cfg.CFG.postorder` from the
+examples and `CFG.dfs` from bril-llvm's `brilpy`. On the functions in the
+input program and on some small random graphs, each must visit the blocks
+in the same order as its recursive counterpart. Then they all traverse
+the `deep.py SHAPE N` program, which is far too deep for recursion.
+"""
+
+import json
+import os
+import random
+import sys
+
+EXAMPLES = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, EXAMPLES)
+sys.path.append(os.path.join(os.path.dirname(EXAMPLES), 'bril-llvm'))
+
+from cfg import block_map, add_entry, add_terminators, successors, CFG
+from form_blocks import form_blocks
+import dom
+import brilpy
+import deep
+
+
+def postorder_rec(succ, root, explored, out):
+    """The old, recursive `dom.postorder_helper`."""
+    if root in explored:
+        return
+    explored.add(root)
+    for s in succ[root]:
+        postorder_rec(succ, s, explored, out)
+    out.append(root)
+
+
+def dfs_rec(cfg, order=None, edges=None):
+    """The old, recursive `brilpy.CFG.dfs`. Return the sequence of
+    calls it makes to its `pre`, `post`, and `next_tree` hooks.
+    """
+    order = order or list(range(cfg.n))
+    edges = edges or cfg.edges
+    seen = set()
+    events = []
+
+    def visit(node):
+        if node not in seen:
+            seen.add(node)
+            events.append(('pre', node))
+            for v in edges[node]:
+                visit(v)
+            events.append(('post', node))
+
+    for i in order:
+        visit(i)
+        events.append(('next',))
+    return events
+
+
+def dfs_events(cfg, order=None, edges=None):
+    events = []
+    cfg.dfs(order, lambda i: events.append(('pre', i)),
+            lambda i: events.append(('post', i)),
+            lambda: events.append(('next',)), edges)
+    return events
+
+
+def traversals(func):
+    """Run every traversal on a function. Return a dict of the orders
+    they visit blocks in, and the graphs they ran on.
+    """
+    blocks = block_map(form_blocks(func['instrs']))
+    add_entry(blocks)
+    add_terminators(blocks)
+    succ = {name: successors(block[-1]) for name, block in blocks.items()}
+    entry = next(iter(blocks))
+    graph = CFG.from_blocks(blocks)
+    bcfg = brilpy.CFG(func)
+    return {
+        'dom.postorder': dom.postorder(succ, entry),
+        'CFG.postorder': [graph.names[i] for i in graph.postorder],
+        'brilpy dfs': dfs_events(bcfg),
+        'brilpy dfs (rpo, preds)': dfs_events(bcfg, bcfg.rpo(), bcfg.preds),
+    }, (succ, entry, bcfg)
+
+
+def check(name, func):
+    """Compare a function's traversals to the recursive ones."""
+    orders, (succ, entry, bcfg) = traversals(func)
+    rec = []
+    postorder_rec(succ, entry, set(), rec)
+    expected = {
+        'dom.postorder': rec,
+        'CFG.postorder': rec,
+        'brilpy dfs': dfs_rec(bcfg),
+        'brilpy dfs (rpo, preds)': dfs_rec(bcfg, bcfg.rpo(), bcfg.preds),
+    }
+    bad = [k for k in orders if orders[k] != expected[k]]
+    print('{}: {}'.format(name, 'differs in ' + ', '.join(bad) if bad
+                          else 'ok'))
+
+
+def random_func(rng):
+    """Make a function whose blocks form a small random graph, with up to
+    two successors each.
+    """
+    n = rng.randint(2, 12)
+    instrs = [{'op': 'const', 'type': 'bool', 'dest': 'c', 'value': True}]
+    for i in range(n):
+        instrs.append({'label': 'n{}'.format(i)})
+        labels = ['n{}'.format(rng.randrange(n))
+                  for _ in range(rng.randint(0, 2))]
+        if not labels:
+            instrs.append({'op': 'ret'})
+        elif len(labels) == 1:
+            instrs.append({'op': 'jmp', 'labels': labels})
+        else:
+            instrs.append({'op': 'br', 'args': ['c'], 'labels': labels})
+    return {'name': 'main', 'instrs': instrs}
+
+
+if __name__ == '__main__':
+    for func in json.load(sys.stdin)['functions']:
+        check(func['name'], func)
+    rng = random.Random(6120)
+    for i in range(50):
+        check('random {}'.format(i), random_func(rng))
+
+    shape, n = sys.argv[1], int(sys.argv[2])
+    func = deep.program(shape, n)['functions'][0]
+    orders, _ = traversals(func)
+    for name, order in orders.items():
+        print('{} {} {}: {} steps, ending {}'.format(
+            shape, n, name, len(order), order[-2:]))
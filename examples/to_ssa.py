@@ -1,10 +1,9 @@
-import json
-import sys
 from collections import defaultdict
 
-from cfg import block_map, successors, add_terminators, add_entry, reassemble
+from cfg import block_map, add_terminators, add_entry, reassemble, CFG
 from form_blocks import form_blocks
-from dom import get_dom, dom_fronts, dom_tree
+from dom import idoms, dom_fronts, dom_tree
+from passcache import run_pass
 
 
 def def_blocks(blocks):
@@ -28,14 +27,16 @@ def get_phis(blocks, df, defs):
     phis = {b: set() for b in blocks}
     for v, v_defs in defs.items():
         v_defs_list = list(v_defs)
+        v_defs_set = set(v_defs)
         for d in v_defs_list:
             for block in df[d]:
                 # Add a phi-node...
                 if v not in phis[block]:
                     # ..unless we already did.
                     phis[block].add(v)
-                    if block not in v_defs_list:
+                    if block not in v_defs_set:
                         v_defs_list.append(block)
+                        v_defs_set.add(block)
     return phis
 
 
@@ -45,49 +46,58 @@ def ssa_rename(blocks, phis, succ, domtree, args):
     phi_dests = {b: {p: None for p in phis[b]} for b in blocks}
     counters = defaultdict(int)
 
-    def _push_fresh(var):
+    def _push_fresh(var, pushed):
         fresh = '{}.{}'.format(var, counters[var])
         counters[var] += 1
-        stack[var].insert(0, fresh)
+        stack[var].append(fresh)
+        pushed.append(var)
         return fresh
 
     def _rename(block):
-        # Save stacks.
-        old_stack = {k: list(v) for k, v in stack.items()}
+        # Record the names pushed here so they can be popped on the way
+        # back up the dominator tree.
+        pushed = []
 
         # Rename phi-node destinations.
         for p in phis[block]:
-            phi_dests[block][p] = _push_fresh(p)
+            phi_dests[block][p] = _push_fresh(p, pushed)
 
         for instr in blocks[block]:
             # Rename arguments in normal instructions.
             if 'args' in instr:
-                new_args = [stack[arg][0] for arg in instr['args']]
+                new_args = [stack[arg][-1] for arg in instr['args']]
                 instr['args'] = new_args
 
             # Rename destinations.
             if 'dest' in instr:
-                instr['dest'] = _push_fresh(instr['dest'])
+                instr['dest'] = _push_fresh(instr['dest'], pushed)
 
         # Rename phi-node arguments (in successors).
         for s in succ[block]:
             for p in phis[s]:
                 if stack[p]:
-                    phi_args[s][p].append((block, stack[p][0]))
+                    phi_args[s][p].append((block, stack[p][-1]))
                 else:
                     # The variable is not defined on this path
                     phi_args[s][p].append((block, "__undefined"))
 
-        # Recursive calls.
-        for b in sorted(domtree[block]):
-            _rename(b)
-
-        # Restore stacks.
-        stack.clear()
-        stack.update(old_stack)
+        return pushed
 
+    # Walk the dominator tree in preorder with an explicit stack, whose
+    # frames hold the names pushed by a block and its remaining
+    # children.
     entry = list(blocks.keys())[0]
-    _rename(entry)
+    walk = [(_rename(entry), iter(sorted(domtree[entry])))]
+    while walk:
+        pushed, children = walk[-1]
+        for b in children:
+            walk.append((_rename(b), iter(sorted(domtree[b]))))
+            break
+        else:
+            # Restore stacks.
+            walk.pop()
+            for var in pushed:
+                stack[var].pop()
 
     return phi_args, phi_dests
 
@@ -105,6 +115,17 @@ def insert_phis(blocks, phi_args, phi_dests, types):
             instrs.insert(0, phi)
 
 
+def drop_unreachable(blocks, graph):
+    """Remove the blocks that can't be reached from the entry. Renaming
+    walks the dominator tree, which never visits them, so they would be
+    left using the old variable names.
+    """
+    reachable = {graph.names[i] for i in graph.postorder}
+    for name in list(blocks):
+        if name not in reachable:
+            del blocks[name]
+
+
 def get_types(func):
     # Silly way to get the type of variables. (According to the Bril
     # spec, well-formed programs must use only a single type for every
@@ -120,17 +141,21 @@ def func_to_ssa(func):
     blocks = block_map(form_blocks(func['instrs']))
     add_entry(blocks)
     add_terminators(blocks)
-    succ = {name: successors(block[-1]) for name, block in blocks.items()}
-    dom = get_dom(succ, list(blocks.keys())[0])
-
-    df = dom_fronts(dom, succ)
+    graph = CFG.from_blocks(blocks)
+    if len(graph.postorder) < len(graph):
+        drop_unreachable(blocks, graph)
+        graph = CFG.from_blocks(blocks)
+    succ = graph.succ_map()
+    idom = idoms(graph)
+
+    df = dom_fronts(graph, idom)
     defs = def_blocks(blocks)
     types = get_types(func)
     arg_names = {a['name'] for a in func['args']} if 'args' in func else set()
 
     phis = get_phis(blocks, df, defs)
-    phi_args, phi_dests = ssa_rename(blocks, phis, succ, dom_tree(dom),
-                                     arg_names)
+    phi_args, phi_dests = ssa_rename(blocks, phis, succ,
+                                     dom_tree(graph, idom), arg_names)
     insert_phis(blocks, phi_args, phi_dests, types)
 
     func['instrs'] = reassemble(blocks)
@@ -143,4 +168,4 @@ def to_ssa(bril):
 
 
 if __name__ == '__main__':
-    print(json.dumps(to_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    run_pass('to_ssa', [], to_ssa)
@@ -1,4 +1,6 @@
 import itertools
+import json
+import sys
 
 
 def flatten(ll):
@@ -16,3 +18,37 @@ def fresh(seed, names):
         if name not in names:
             return name
         i += 1
+
+
+def load_bril(data):
+    """Load a Bril program from bytes, either JSON or in the binary
+    format (see `briltxt.encode_bin`). Return the program and a bool
+    indicating whether it was binary.
+    """
+    if data.lstrip()[:1] == b'{':
+        return json.loads(data), False
+    import briltxt
+    return briltxt.decode_bin(data), True
+
+
+def dump_bril(bril, binary=False):
+    """Serialize a Bril program to bytes, either as JSON or in the
+    binary format.
+    """
+    if binary:
+        import briltxt
+        return briltxt.encode_bin(bril)
+    else:
+        return (json.dumps(bril, indent=2, sort_keys=True) + '\n').encode()
+
+
+def read_bril():
+    """Read a Bril program from standard input (see `load_bril`).
+    """
+    return load_bril(sys.stdin.buffer.read())
+
+
+def write_bril(bril, binary=False):
+    """Write a Bril program to standard output (see `dump_bril`).
+    """
+    sys.stdout.buffer.write(dump_bril(bril, binary))